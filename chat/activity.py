@@ -0,0 +1,33 @@
+# activity.py
+from django.db import models
+
+from .models import Room
+
+
+def record_last_messages(messages):
+    """
+    Point Room.last_message / last_activity_at at the newest saved message
+    of each room in ``messages``. Call it inside the transaction that
+    inserted them.
+
+    The pointer only moves to a higher message id, so concurrent writers
+    to the same room cannot move it backwards.
+    """
+    latest = {}
+    for message in messages:
+        if message.pk is None:
+            continue
+        current = latest.get(message.room_id)
+        if current is None or message.pk > current.pk:
+            latest[message.room_id] = message
+
+    for room_id, message in latest.items():
+        (
+            Room.objects
+            .filter(
+                models.Q(last_message__isnull=True)
+                | models.Q(last_message_id__lt=message.pk),
+                pk=room_id,
+            )
+            .update(last_message=message, last_activity_at=message.timestamp)
+        )
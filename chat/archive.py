@@ -0,0 +1,83 @@
+# archive.py
+import json
+import zlib
+
+from django.db import transaction
+
+from .models import ArchivedMessage, Message, Room
+
+# Message columns packed into ArchivedMessage.payload
+PAYLOAD_FIELDS = (
+    "encrypted_text",
+    "key_version",
+    "encrypted_for_sender",
+    "encrypted_for_receiver",
+)
+
+
+def pack(message):
+    """ArchivedMessage for a Message (not saved)."""
+    payload = {field: getattr(message, field) for field in PAYLOAD_FIELDS}
+    return ArchivedMessage(
+        id=message.id,
+        room_id=message.room_id,
+        user_id=message.user_id,
+        timestamp=message.timestamp,
+        payload=zlib.compress(
+            json.dumps(payload, separators=(",", ":")).encode(), 9
+        ),
+    )
+
+
+def unpack(archived):
+    """
+    Unsaved Message with the archived row's contents, so serializers and
+    pagination treat both tiers alike. Related objects already loaded on
+    ``archived`` (select_related) are reused.
+    """
+    message = Message(
+        id=archived.id,
+        room_id=archived.room_id,
+        user_id=archived.user_id,
+        timestamp=archived.timestamp,
+        **json.loads(zlib.decompress(bytes(archived.payload))),
+    )
+    for field in ("room", "user"):
+        if ArchivedMessage._meta.get_field(field).is_cached(archived):
+            setattr(message, field, getattr(archived, field))
+    return message
+
+
+def archivable(cutoff):
+    """
+    Messages older than ``cutoff``, minus each room's latest message so
+    Room.last_message (inbox) keeps pointing at a hot row.
+    """
+    return (
+        Message.objects
+        .filter(timestamp__lt=cutoff)
+        .exclude(
+            id__in=Room.objects
+            .filter(last_message__isnull=False)
+            .values("last_message_id")
+        )
+    )
+
+
+def archive_batch(cutoff, batch_size):
+    """
+    Move up to ``batch_size`` archivable messages, oldest id first, in one
+    transaction. Returns the number moved; 0 means nothing is left.
+    """
+    with transaction.atomic():
+        messages = list(archivable(cutoff).order_by("id")[:batch_size])
+        if not messages:
+            return 0
+
+        ArchivedMessage.objects.bulk_create(
+            [pack(message) for message in messages],
+            ignore_conflicts=True,
+        )
+        Message.objects.filter(id__in=[message.id for message in messages]).delete()
+    return len(messages)
+
@@ -0,0 +1,44 @@
+# conditional.py
+import hashlib
+
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+
+def make_etag(*parts):
+    """Strong ETag over the repr of ``parts``."""
+    digest = hashlib.sha1(repr(parts).encode()).hexdigest()
+    return quote_etag(digest)
+
+
+def not_modified(request, etag, last_modified=None):
+    """
+    Return a 304 Response if the request's If-None-Match (or, without it,
+    If-Modified-Since) shows the client already has this representation.
+    ``last_modified`` is a datetime or None.
+    """
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match:
+        matched = etag in parse_etags(if_none_match) or if_none_match.strip() == "*"
+    elif last_modified is not None and request.headers.get("If-Modified-Since"):
+        since = parse_http_date_safe(request.headers["If-Modified-Since"])
+        matched = since is not None and int(last_modified.timestamp()) <= since
+    else:
+        matched = False
+
+    if not matched:
+        return None
+
+    response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    set_validators(response, etag, last_modified)
+    return response
+
+
+def set_validators(response, etag, last_modified=None):
+    response["ETag"] = etag
+    if last_modified is not None:
+        response["Last-Modified"] = http_date(last_modified.timestamp())
+    # Per-user data: caches may keep it but must revalidate every time
+    response["Cache-Control"] = "private, no-cache"
+    return response
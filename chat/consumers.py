@@ -1,18 +1,177 @@
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from .models import Room, Message, UserProfile
-import json
+from .models import UserProfile
+from . import fanout, presence, ratelimit
+from .db import db_async
+from .framing import FramedConsumerMixin
+from .rooms import RoomSession
+from urllib.parse import parse_qs
+import asyncio
 
 User = get_user_model()
 
 
-class ChatConsumer(AsyncWebsocketConsumer):
+class ScopeProfileMixin:
+    """
+    TokenAuthMiddleware resolves the UserProfile together with the user
+    and caches both, so this is normally free. The DB is only hit for
+    connections authenticated some other way.
+    """
+
+    async def get_scope_profile(self):
+        profile = self.scope.get("profile")
+        if profile is None and self.scope["user"].is_authenticated:
+            profile = await self.load_profile()
+        return profile
+
+    @db_async
+    def load_profile(self):
+        return (
+            UserProfile.objects
+            .select_related("user")
+            .filter(user=self.scope["user"])
+            .first()
+        )
+
+    async def get_profile_and_username(self):
+        profile = await self.get_scope_profile()
+        if profile is None:
+            return None
+        return {
+            "profile": profile,
+            "username": profile.user.username,
+        }
+
+
+class CoalescedNotifyMixin:
+    """
+    Debounces "notify" events per connection. Everything that arrives
+    within CHAT_NOTIFY_DEBOUNCE_MS of the first event on a stream goes out
+    as one REFRESH_GROUPS / REFRESH_CONTACTS frame:
+
+        {"type": "REFRESH_GROUPS", "added": [...], "removed": [...],
+         "full": false}
+
+    The latest change per id wins. ``full`` is true when one of the
+    merged events carried no delta, i.e. the client should refetch.
+    """
+
+    NOTIFY_FRAMES = {
+        "groups": "REFRESH_GROUPS",
+        "contacts": "REFRESH_CONTACTS",
+    }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pending_notify = {}
+        self.notify_timers = {}
+
+    async def queue_notify(self, stream, event):
+        pending = self.pending_notify.setdefault(
+            stream, {"changes": {}, "full": False}
+        )
+        changes = pending["changes"]
+
+        if "added" not in event and "removed" not in event:
+            pending["full"] = True
+        for key in event.get("added", ()):
+            changes[key] = "added"
+        for key in event.get("removed", ()):
+            changes[key] = "removed"
+
+        delay = getattr(settings, "CHAT_NOTIFY_DEBOUNCE_MS", 250) / 1000
+        if delay <= 0:
+            await self.flush_notify(stream)
+        elif stream not in self.notify_timers:
+            self.notify_timers[stream] = asyncio.create_task(
+                self.flush_notify_later(stream, delay)
+            )
+
+    async def flush_notify_later(self, stream, delay):
+        await asyncio.sleep(delay)
+        self.notify_timers.pop(stream, None)
+        await self.flush_notify(stream)
+
+    async def flush_notify(self, stream):
+        pending = self.pending_notify.pop(stream, None)
+        if pending is None:
+            return
+
+        changes = pending["changes"]
+        await self.send_event({
+            "type": self.NOTIFY_FRAMES[stream],
+            "added": [key for key, op in changes.items() if op == "added"],
+            "removed": [key for key, op in changes.items() if op == "removed"],
+            "full": pending["full"],
+        })
+
+    def cancel_notify(self):
+        for task in self.notify_timers.values():
+            task.cancel()
+        self.notify_timers.clear()
+        self.pending_notify.clear()
+
+
+class PresenceMixin:
+    """
+    Online/offline tracking for the connection's profile (presence.py).
+    A heartbeat task keeps the entry alive while the socket is open, so
+    connections of a crashed worker expire after CHAT_PRESENCE_TTL.
+    """
+
+    presence_profile_id = None
+    presence_task = None
+
+    async def track_presence(self, profile_id):
+        if profile_id is None:
+            return
+        self.presence_profile_id = profile_id
+        if await presence.connect(profile_id):
+            await presence.announce(self.channel_layer, profile_id, online=True)
+        self.presence_task = asyncio.create_task(self.presence_heartbeat())
+
+    async def presence_heartbeat(self):
+        interval = getattr(settings, "CHAT_PRESENCE_HEARTBEAT", 20)
+        while True:
+            await asyncio.sleep(interval)
+            if await presence.heartbeat(self.presence_profile_id):
+                await presence.announce(
+                    self.channel_layer, self.presence_profile_id, online=True
+                )
+
+    async def untrack_presence(self):
+        if self.presence_task is not None:
+            self.presence_task.cancel()
+            self.presence_task = None
+        if self.presence_profile_id is None:
+            return
+
+        profile_id, self.presence_profile_id = self.presence_profile_id, None
+        last_seen = await presence.disconnect(profile_id)
+        if last_seen is not None:
+            await presence.announce(
+                self.channel_layer, profile_id, online=False, last_seen=last_seen
+            )
+
+    async def presence(self, event):
+        if event["profile_id"] == self.presence_profile_id:
+            return
+        await self.send_event(event)
+
+
+class ChatConsumer(PresenceMixin, FramedConsumerMixin, ScopeProfileMixin, AsyncWebsocketConsumer):
+    """
+    One connection per room. The room logic and the delivery protocol
+    (seq/ack/resume) live in rooms.RoomSession.
+    """
+
+    session = None
+
     async def connect(self):
         self.user = self.scope["user"]
         self.room_id = self.scope["url_route"]["kwargs"]["room_id"]
-        self.room_group_name = f"chat_{self.room_id}_user_{self.user.id}"
-        
+
         if not self.user.is_authenticated:
             await self.close()
             return
@@ -24,165 +183,247 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
         self.profile = data["profile"]
         self.username = data["username"]
+        self.send_bucket = ratelimit.connection_bucket()
 
-        if not await self.is_user_in_room():
+        session = RoomSession(self, self.room_id)
+        if not await session.open():
             await self.close()
             return
-
-        await self.channel_layer.group_add(
-            self.room_group_name,
-            self.channel_name,
-        )
+        self.session = session
 
         await self.accept()
+        await self.track_presence(self.profile.id)
+        await self.session.resume(self.get_last_id_param())
 
     async def disconnect(self, close_code):
-        await self.channel_layer.group_discard(
-            self.room_group_name,
-            self.channel_name,
-        )
+        await self.untrack_presence()
+        if self.session is not None:
+            await self.session.close()
+
+    async def receive(self, text_data=None, bytes_data=None):
+        await self.session.receive(self.decode_frame(text_data, bytes_data))
+
+    async def chat_message(self, event):
+        await self.session.chat_message(event)
+
+    async def removed(self,event):
+        await self.send_event(event)
+
+    async def room_members_changed(self, event):
+        await self.session.room_members_changed(event)
+
+    async def room_key_rotated(self, event):
+        await self.session.room_key_rotated(event)
+
+    async def typing(self, event):
+        await self.session.typing(event)
+
+    def get_last_id_param(self):
+        query = parse_qs(self.scope.get("query_string", b"").decode())
+        try:
+            return int(query["last_id"][0])
+        except (KeyError, ValueError):
+            return None
+
+
+class MultiplexConsumer(
+    PresenceMixin,
+    CoalescedNotifyMixin,
+    FramedConsumerMixin,
+    ScopeProfileMixin,
+    AsyncWebsocketConsumer,
+):
+    """
+    A single connection per client carrying any number of rooms plus the
+    group/contact list notifications.
+
+    Control frames:
+      {"type": "subscribe", "stream": "room", "room_id": N, "last_id": M}
+      {"type": "unsubscribe", "stream": "room", "room_id": N}
+      {"type": "subscribe" | "unsubscribe", "stream": "groups" | "contacts"}
 
-    async def receive(self, text_data):
-        data = json.loads(text_data)
+    Every other client frame must carry "room_id" and is handled exactly
+    like a ChatConsumer frame for that room. Every room frame sent to the
+    client carries "room_id" too.
+    """
+
+    async def connect(self):
+        self.user = self.scope["user"]
+        self.sessions = {}
+        self.streams = set()
+        self.presence_seen = {}
 
-        room = await self.get_room()
-        if not await self.is_user_in_room():
-            await self.send(text_data=json.dumps({
-                "type": "removed"
-            }))
+        if not self.user.is_authenticated:
+            await self.close()
             return
 
-        # =====================================================
-        # GROUP CHAT
-        # =====================================================
-        if room.is_group:
-            encrypted_text = data.get("encrypted_text")
-            if not encrypted_text:
-                return
-
-            message = await self.create_group_message(
-                encrypted_text=encrypted_text,
-                key_version=room.key_version,
-            )
-            
-            participants = await self.get_room_participants()
-
-            for profile_id in participants:
-                await self.channel_layer.group_send(
-                    f"chat_{self.room_id}_user_{profile_id}",
-                    {
-                        "type": "chat_message",
-                        "id": message.id,
-                        "encrypted_text": message.encrypted_text,
-                        "key_version": message.key_version,
-                        "user": self.username,
-                        "timestamp": message.timestamp.isoformat(),
-                    },
-            )
+        data = await self.get_profile_and_username()
+        if not data:
+            await self.close()
+            return
 
-        # =====================================================
-        # 1-1 CHAT
-        # =====================================================
-        else:
-            enc_sender = data.get("encrypted_for_sender")
-            enc_receiver = data.get("encrypted_for_receiver")
+        self.profile = data["profile"]
+        self.username = data["username"]
+        self.send_bucket = ratelimit.connection_bucket()
 
-            if not enc_sender or not enc_receiver:
-                return
+        await self.accept()
+        await self.send_event({
+            "type": "connected",
+        })
+        await self.track_presence(self.profile.id)
 
-            message = await self.create_private_message(
-                enc_sender,
-                enc_receiver,
+    async def disconnect(self, close_code):
+        await self.untrack_presence()
+        self.cancel_notify()
+
+        for session in list(self.sessions.values()):
+            await session.close()
+        self.sessions.clear()
+
+        for stream in list(self.streams):
+            await self.channel_layer.group_discard(
+                fanout.notification_group(stream, self.profile.id),
+                self.channel_name,
             )
+        self.streams.clear()
 
-            participants = await self.get_room_participants()
-
-            for profile_id in participants:
-                await self.channel_layer.group_send(
-                    f"chat_{self.room_id}_user_{profile_id}",
-                    {
-                        "type": "chat_message",
-                        "id": message.id,
-                        "encrypted_for_sender": message.encrypted_for_sender,
-                        "encrypted_for_receiver": message.encrypted_for_receiver,
-                        "user_id": self.profile.id,
-                        "user": self.username,
-                        "timestamp": message.timestamp.isoformat(),
-                    }
-                )
+    async def receive(self, text_data=None, bytes_data=None):
+        data = self.decode_frame(text_data, bytes_data)
 
-    async def chat_message(self, event):
-        await self.send(text_data=json.dumps(event))
-        
-    async def removed(self,event):
-        await self.send(text_data=json.dumps(event))
-        
-    async def room_key_rotated(self, event):
-        """
-        Handler for room.key_rotated events
-        """
-        await self.send(
-            text_data=json.dumps({
-                "type": "room.key_rotated",
-                "version": event["version"],
-            })
-        )
+        if data.get("type") == "subscribe":
+            await self.subscribe(data)
+            return
+        if data.get("type") == "unsubscribe":
+            await self.unsubscribe(data)
+            return
+
+        session = self.get_session(data.get("room_id"))
+        if session is None:
+            await self.send_error("not_subscribed", data)
+            return
+
+        await session.receive(data)
 
     # =====================================================
-    # DB helpers (ALL SAFE)
+    # Subscriptions
     # =====================================================
 
-    @database_sync_to_async
-    def get_profile_and_username(self):
+    async def subscribe(self, data):
+        stream = data.get("stream")
+
+        if stream in fanout.NOTIFICATION_STREAMS:
+            if stream not in self.streams:
+                await self.channel_layer.group_add(
+                    fanout.notification_group(stream, self.profile.id),
+                    self.channel_name,
+                )
+                self.streams.add(stream)
+            await self.send_event({"type": "subscribed", "stream": stream})
+            return
+
+        if stream != "room":
+            await self.send_error("unknown_stream", data)
+            return
+
         try:
-            profile = UserProfile.objects.select_related("user").get(user=self.user)
-            return {
-                "profile": profile,
-                "username": profile.user.username,
-            }
-        except UserProfile.DoesNotExist:
-            return None
+            room_id = int(data.get("room_id"))
+        except (TypeError, ValueError):
+            await self.send_error("invalid_room", data)
+            return
 
+        if room_id in self.sessions:
+            # Already open: treat as a resume
+            await self.sessions[room_id].resume(data.get("last_id"))
+            return
 
-    @database_sync_to_async
-    def is_user_in_room(self):
-        room = Room.objects.get(id=self.room_id)
-        return room.participants.filter(id=self.profile.id).exists()
+        if len(self.sessions) >= getattr(settings, "CHAT_MUX_MAX_ROOMS", 100):
+            await self.send_error("too_many_rooms", data)
+            return
 
-    @database_sync_to_async
-    def get_room(self):
-        return Room.objects.get(id=self.room_id)
+        session = RoomSession(self, room_id, tag={"room_id": room_id})
+        if not await session.open():
+            await session.close()
+            await self.send_error("forbidden", data)
+            return
+        self.sessions[room_id] = session
+
+        await self.send_event({
+            "type": "subscribed",
+            "stream": "room",
+            "room_id": room_id,
+        })
+        await session.resume(data.get("last_id"))
+
+    async def unsubscribe(self, data):
+        stream = data.get("stream")
+
+        if stream in fanout.NOTIFICATION_STREAMS:
+            if stream in self.streams:
+                await self.channel_layer.group_discard(
+                    fanout.notification_group(stream, self.profile.id),
+                    self.channel_name,
+                )
+                self.streams.discard(stream)
+            self.pending_notify.pop(stream, None)
+            return
 
-    @database_sync_to_async
-    def create_group_message(self, encrypted_text, key_version):
-        room = Room.objects.get(id=self.room_id)
-        return Message.objects.create(
-            room=room,
-            user=self.profile,
-            encrypted_text=encrypted_text,
-            key_version=key_version,
-        )
+        session = self.get_session(data.get("room_id"))
+        if session is not None:
+            await session.close()
+            del self.sessions[session.room_id]
 
-    @database_sync_to_async
-    def create_private_message(self, enc_sender, enc_receiver):
-        room = Room.objects.get(id=self.room_id)
-        return Message.objects.create(
-            room=room,
-            user=self.profile,
-            encrypted_for_sender=enc_sender,
-            encrypted_for_receiver=enc_receiver,
-        )
+    def get_session(self, room_id):
+        try:
+            return self.sessions.get(int(room_id))
+        except (TypeError, ValueError):
+            return None
 
-    @database_sync_to_async
-    def get_room_participants(self):
-        room = Room.objects.get(id=self.room_id)
-        return list(room.participants.values_list("user_id", flat=True))
+    async def send_error(self, reason, data):
+        await self.send_event({
+            "type": "error",
+            "reason": reason,
+            "stream": data.get("stream"),
+            "room_id": data.get("room_id"),
+        })
 
+    # =====================================================
+    # Channel layer events
+    # =====================================================
+
+    async def chat_message(self, event):
+        session = self.get_session(event.get("room_id"))
+        if session is not None:
+            await session.chat_message(event)
 
+    async def room_members_changed(self, event):
+        session = self.get_session(event.get("room_id"))
+        if session is not None:
+            await session.room_members_changed(event)
+
+    async def room_key_rotated(self, event):
+        session = self.get_session(event.get("room_id"))
+        if session is not None:
+            await session.room_key_rotated(event)
+
+    async def typing(self, event):
+        session = self.get_session(event.get("room_id"))
+        if session is not None:
+            await session.typing(event)
+
+    async def presence(self, event):
+        # The same change can arrive through several rooms and the
+        # contacts stream
+        profile_id = event["profile_id"]
+        if self.presence_seen.get(profile_id) == event["online"]:
+            return
+        self.presence_seen[profile_id] = event["online"]
+        await super().presence(event)
 
+    async def notify(self, event):
+        await self.queue_notify(event.get("stream", "groups"), event)
 
 
-class GroupConsumer(AsyncWebsocketConsumer):
+class GroupConsumer(PresenceMixin, CoalescedNotifyMixin, FramedConsumerMixin, ScopeProfileMixin, AsyncWebsocketConsumer):
     async def connect(self):
         self.user = self.scope["user"]
         self.profile_id=await self.get_profile_id()
@@ -191,7 +432,7 @@ class GroupConsumer(AsyncWebsocketConsumer):
             await self.close()
             return
 
-        self.group_name = f"group_list_{self.profile_id}"
+        self.group_name = fanout.notification_group("groups", self.profile_id)
 
         await self.channel_layer.group_add(
             self.group_name,
@@ -200,13 +441,15 @@ class GroupConsumer(AsyncWebsocketConsumer):
 
         await self.accept()
         
-        await self.send(
-            text_data=json.dumps({
-                "type":"connected",
-                "name":self.group_name
-            }))
+        await self.send_event({
+            "type":"connected",
+            "name":self.group_name
+        })
+        await self.track_presence(self.profile_id)
 
     async def disconnect(self, close_code):
+        await self.untrack_presence()
+        self.cancel_notify()
         await self.channel_layer.group_discard(
             self.group_name,
             self.channel_name
@@ -224,23 +467,17 @@ class GroupConsumer(AsyncWebsocketConsumer):
     #         )
             
     async def notify(self, event):
-        await self.send(text_data=json.dumps({
-            "type": "REFRESH_GROUPS"
-        }))
+        await self.queue_notify("groups", event)
         
-    @database_sync_to_async
-    def get_profile_id(self):
-        try:
-            profile = UserProfile.objects.select_related("user").get(user=self.user)
-            return profile.id 
-        except UserProfile.DoesNotExist:
-            return None
+    async def get_profile_id(self):
+        profile = await self.get_scope_profile()
+        return profile.id if profile else None
         
         
         
         
         
-class ContactNotifyConsumer(AsyncWebsocketConsumer):
+class ContactNotifyConsumer(PresenceMixin, CoalescedNotifyMixin, FramedConsumerMixin, ScopeProfileMixin, AsyncWebsocketConsumer):
     async def connect(self):
         self.user = self.scope["user"]
         self.profile_id=await self.get_profile_id()
@@ -249,7 +486,7 @@ class ContactNotifyConsumer(AsyncWebsocketConsumer):
             await self.close()
             return
         
-        self.group_name = f"contact_list_{self.profile_id}"
+        self.group_name = fanout.notification_group("contacts", self.profile_id)
 
         await self.channel_layer.group_add(
             self.group_name,
@@ -258,28 +495,24 @@ class ContactNotifyConsumer(AsyncWebsocketConsumer):
 
         await self.accept()
         
-        await self.send(
-            text_data=json.dumps({
-                "type":"connected",
-                "name":self.group_name
-            }))
+        await self.send_event({
+            "type":"connected",
+            "name":self.group_name
+        })
+        await self.track_presence(self.profile_id)
 
     async def disconnect(self, close_code):
+        await self.untrack_presence()
+        self.cancel_notify()
         await self.channel_layer.group_discard(
-            f"contact_list_{self.user.id}",
+            self.group_name,
             self.channel_name
         )
 
     async def notify(self, event):
-        await self.send(text_data=json.dumps({
-            "type": "REFRESH_CONTACTS"
-        }))
+        await self.queue_notify("contacts", event)
         
-    @database_sync_to_async
-    def get_profile_id(self):
-        try:
-            profile = UserProfile.objects.select_related("user").get(user=self.user)
-            return profile.id 
-        except UserProfile.DoesNotExist:
-            return None
+    async def get_profile_id(self):
+        profile = await self.get_scope_profile()
+        return profile.id if profile else None
         
\ No newline at end of file
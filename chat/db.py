@@ -0,0 +1,26 @@
+# db.py
+from concurrent.futures import ThreadPoolExecutor
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+
+# database_sync_to_async (and Django's own aget/acreate/aexists, which
+# wrap sync_to_async the same way) is thread-sensitive by default: with no
+# ThreadSensitiveContext, as in every Channels consumer, all calls of the
+# process queue up on one shared thread. Consumer DB helpers are
+# self-contained (any transaction opens and commits inside one call), so
+# they can run side by side on a bounded pool instead: CHAT_DB_THREADS
+# threads, one connection each, on top of what REST views use (the
+# psycopg pool is sized for both in settings).
+executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, "CHAT_DB_THREADS", 8),
+    thread_name_prefix="chat-db",
+)
+
+
+def db_async(func):
+    """
+    database_sync_to_async on the chat DB pool. Use for helpers that do
+    not rely on thread-local state surviving between calls.
+    """
+    return database_sync_to_async(func, thread_sensitive=False, executor=executor)
@@ -0,0 +1,66 @@
+# fanout.py
+from django.conf import settings
+
+
+def room_group(room_id):
+    """Room-wide group every member connection of the room joins."""
+    return f"chat_{room_id}"
+
+
+def user_group(room_id, user_id):
+    """Per-user group, used for control events aimed at one member."""
+    return f"chat_{room_id}_user_{user_id}"
+
+
+def fanout_mode():
+    return getattr(settings, "CHAT_FANOUT_MODE", "room")
+
+
+def member_groups(room_id, user_ids, mode=None):
+    """
+    Groups that together reach every member connection of a room.
+    ``user_ids`` is only iterated in "per_user" mode.
+    """
+    mode = mode or fanout_mode()
+
+    if mode == "room":
+        return [room_group(room_id)]
+
+    return [user_group(room_id, user_id) for user_id in user_ids]
+
+
+async def publish(channel_layer, room_id, user_ids, event, mode=None):
+    """
+    Deliver a chat event to every member of a room.
+
+    "room" mode publishes once to the room group, so the cost per message
+    does not depend on the number of participants. "per_user" mode keeps
+    the old behaviour of one group_send per participant.
+    """
+    for group in member_groups(room_id, user_ids, mode):
+        await channel_layer.group_send(group, event)
+
+
+# Per-profile notification groups ("notify" events) and the stream name a
+# MultiplexConsumer subscribes to for each.
+NOTIFICATION_STREAMS = {
+    "groups": "group_list_{}",
+    "contacts": "contact_list_{}",
+}
+
+
+def notification_group(stream, profile_id):
+    return NOTIFICATION_STREAMS[stream].format(profile_id)
+
+
+def notify_event(stream, added=(), removed=()):
+    """
+    "notify" event for a notification group. ``added``/``removed`` are
+    room ids on the groups stream and profile ids on the contacts stream.
+    """
+    return {
+        "type": "notify",
+        "stream": stream,
+        "added": list(added),
+        "removed": list(removed),
+    }
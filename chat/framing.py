@@ -0,0 +1,137 @@
+# framing.py
+import asyncio
+import base64
+import binascii
+import json
+
+import msgpack
+from django.conf import settings
+
+MSGPACK_SUBPROTOCOL = "chat.msgpack.v1"
+
+# Closed because the client could not keep up with its frames
+OUTBOX_OVERFLOW_CLOSE_CODE = 4008
+
+# base64 text in the DB and in JSON frames, raw bytes in msgpack frames
+CIPHERTEXT_FIELDS = (
+    "encrypted_text",
+    "encrypted_for_sender",
+    "encrypted_for_receiver",
+)
+
+
+class JsonCodec:
+    subprotocol = None
+
+    def encode(self, event):
+        return {"text_data": json.dumps(event)}
+
+    def decode(self, text_data=None, bytes_data=None):
+        return json.loads(text_data if text_data is not None else bytes_data)
+
+
+class MsgpackCodec:
+    subprotocol = MSGPACK_SUBPROTOCOL
+
+    def encode(self, event):
+        event = dict(event)
+        for field in CIPHERTEXT_FIELDS:
+            value = event.get(field)
+            if isinstance(value, str):
+                try:
+                    event[field] = base64.b64decode(value, validate=True)
+                except (binascii.Error, ValueError):
+                    pass
+        return {"bytes_data": msgpack.packb(event, use_bin_type=True)}
+
+    def decode(self, text_data=None, bytes_data=None):
+        if bytes_data is None:
+            return json.loads(text_data)
+
+        data = msgpack.unpackb(bytes_data, raw=False)
+        if not isinstance(data, dict):
+            raise ValueError("msgpack frame must be a map")
+        for field in CIPHERTEXT_FIELDS:
+            value = data.get(field)
+            if isinstance(value, bytes):
+                data[field] = base64.b64encode(value).decode("ascii")
+        return data
+
+
+def negotiate(scope):
+    """Pick the codec for a connection from its requested subprotocols."""
+    if MSGPACK_SUBPROTOCOL in scope.get("subprotocols", []):
+        return MsgpackCodec()
+    return JsonCodec()
+
+
+class FramedConsumerMixin:
+    """
+    Frames events as JSON text, or as msgpack binary when the client asks
+    for the chat.msgpack.v1 subprotocol (ciphertext then travels as raw
+    bytes instead of base64 strings).
+
+    Frames go through a bounded per-connection outbox drained by one
+    writer task. When a slow client lets CHAT_OUTBOUND_QUEUE_SIZE live
+    frames pile up, CHAT_OUTBOUND_OVERFLOW decides: "close" ends the
+    connection (the client reconnects and resumes from its last id),
+    "drop" discards the new frame. Replays pass ``wait=True`` and wait for
+    room instead, so a large gap is paced rather than overflowing.
+
+    The outbox only fills when ``send`` waits for the socket to drain.
+    uvicorn's websockets protocol does (see Procfile); Daphne writes
+    straight to the Twisted transport, which then buffers without limit.
+    """
+
+    codec = JsonCodec()
+    outbox = None
+    outbox_task = None
+    outbox_closed = False
+
+    async def accept(self, subprotocol=None, headers=None):
+        self.codec = negotiate(self.scope)
+        await super().accept(subprotocol or self.codec.subprotocol, headers)
+
+        self.outbox = asyncio.Queue(
+            maxsize=getattr(settings, "CHAT_OUTBOUND_QUEUE_SIZE", 256)
+        )
+        self.outbox_task = asyncio.create_task(self.drain_outbox())
+
+    async def send_event(self, event, wait=False):
+        if self.outbox_closed:
+            return
+        if self.outbox is None:
+            await self.send(**self.codec.encode(event))
+            return
+
+        if wait:
+            await self.outbox.put(self.codec.encode(event))
+            return
+
+        try:
+            self.outbox.put_nowait(self.codec.encode(event))
+        except asyncio.QueueFull:
+            await self.outbox_overflow()
+
+    async def drain_outbox(self):
+        while True:
+            frame = await self.outbox.get()
+            await self.send(**frame)
+
+    async def outbox_overflow(self):
+        if getattr(settings, "CHAT_OUTBOUND_OVERFLOW", "close") == "drop":
+            return
+
+        # Stop queueing and let the client reconnect + replay
+        self.outbox_closed = True
+        self.outbox_task.cancel()
+        await self.close(code=OUTBOX_OVERFLOW_CLOSE_CODE)
+
+    async def websocket_disconnect(self, message):
+        self.outbox_closed = True
+        if self.outbox_task is not None:
+            self.outbox_task.cancel()
+        await super().websocket_disconnect(message)
+
+    def decode_frame(self, text_data=None, bytes_data=None):
+        return self.codec.decode(text_data, bytes_data)
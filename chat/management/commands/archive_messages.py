@@ -0,0 +1,47 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from chat import archive
+
+
+class Command(BaseCommand):
+    help = (
+        "Move messages older than --days from the Message table into the "
+        "compressed ArchivedMessage table. Each room keeps its latest "
+        "message; history stays readable through MessageViewSet."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days", type=int,
+            default=getattr(settings, "CHAT_ARCHIVE_AFTER_DAYS", 180),
+            help="Archive messages older than this many days.",
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=1000,
+            help="Messages moved per transaction.",
+        )
+        parser.add_argument(
+            "--dry-run", action="store_true",
+            help="Only count the messages that would be archived.",
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options["days"])
+
+        if options["dry_run"]:
+            count = archive.archivable(cutoff).count()
+            self.stdout.write(f"{count} messages older than {cutoff:%Y-%m-%d} would be archived.")
+            return
+
+        moved = 0
+        while True:
+            batch = archive.archive_batch(cutoff, options["batch_size"])
+            if not batch:
+                break
+            moved += batch
+
+        self.stdout.write(self.style.SUCCESS(f"Archived {moved} messages."))
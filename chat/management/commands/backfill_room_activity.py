@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+from django.db import models, transaction
+
+from chat.models import Message, Room
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill Room.last_message / last_activity_at from the Message table "
+        "for rooms written before those columns existed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=1000,
+            help="Rooms updated per transaction.",
+        )
+        parser.add_argument(
+            "--all", action="store_true",
+            help="Recompute every room, not only rooms without last_message.",
+        )
+
+    def handle(self, *args, **options):
+        rooms = Room.objects.order_by("id")
+        if not options["all"]:
+            rooms = rooms.filter(last_message__isnull=True)
+
+        latest = (
+            Message.objects
+            .filter(room=models.OuterRef("pk"))
+            .order_by("-id")
+        )
+
+        updated = 0
+        last_id = 0
+        while True:
+            ids = list(
+                rooms.filter(id__gt=last_id)
+                .values_list("id", flat=True)[:options["batch_size"]]
+            )
+            if not ids:
+                break
+            last_id = ids[-1]
+
+            with transaction.atomic():
+                updated += Room.objects.filter(id__in=ids).update(
+                    last_message_id=models.Subquery(latest.values("id")[:1]),
+                    last_activity_at=models.Subquery(
+                        latest.values("timestamp")[:1]
+                    ),
+                )
+
+        self.stdout.write(self.style.SUCCESS(f"Updated {updated} rooms."))
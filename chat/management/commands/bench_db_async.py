@@ -0,0 +1,109 @@
+import asyncio
+import statistics
+import time
+
+from channels.db import database_sync_to_async
+from django.core.management.base import BaseCommand
+from django.db.backends.signals import connection_created
+
+from chat.db import db_async
+from chat.models import Room
+
+
+def room_state_query(room_id):
+    # Same lookup as RoomSession.load_room_state
+    return (
+        Room.objects
+        .filter(id=room_id)
+        .values("is_group", "key_version")
+        .first()
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Per-call latency of consumer DB helpers under concurrency: "
+        "thread-sensitive database_sync_to_async, Django's async ORM "
+        "(afirst) and the chat.db pool."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--connections", type=int, nargs="+", default=[1, 10, 100],
+            help="Concurrent connections, each issuing queries back to back.",
+        )
+        parser.add_argument(
+            "--queries", type=int, default=20,
+            help="Queries per connection.",
+        )
+        parser.add_argument(
+            "--latency-ms", type=float, default=0,
+            help="Extra delay added to every query, to emulate the network "
+                 "round trip to a remote database (e.g. 1 for Postgres).",
+        )
+        parser.add_argument(
+            "--room-id", type=int, default=1,
+            help="Room looked up by each query (need not exist).",
+        )
+
+    def handle(self, *args, **options):
+        latency = options["latency_ms"] / 1000
+        if latency:
+            def delay(execute, sql, params, many, context):
+                time.sleep(latency)
+                return execute(sql, params, many, context)
+
+            def add_latency(connection, **kwargs):
+                # Fires again when a thread reconnects on the same wrapper
+                if delay not in connection.execute_wrappers:
+                    connection.execute_wrappers.append(delay)
+
+            # Worker threads open their own connections after this
+            connection_created.connect(add_latency, weak=False)
+
+        asyncio.run(self.run(options))
+
+    async def run(self, options):
+        room_id = options["room_id"]
+        modes = {
+            "sensitive": database_sync_to_async(room_state_query),
+            "async_orm": lambda room_id: (
+                Room.objects
+                .filter(id=room_id)
+                .values("is_group", "key_version")
+                .afirst()
+            ),
+            "pool": db_async(room_state_query),
+        }
+
+        self.stdout.write(
+            f"{'connections':>11} {'mode':>10} {'queries/s':>10} "
+            f"{'p50 ms':>8} {'p99 ms':>8}"
+        )
+        for connections in options["connections"]:
+            for mode, query in modes.items():
+                result = await self.bench(query, room_id, connections, options["queries"])
+                self.stdout.write(
+                    f"{connections:>11} {mode:>10} {result['rate']:>10.0f} "
+                    f"{result['p50'] * 1000:>8.2f} {result['p99'] * 1000:>8.2f}"
+                )
+
+    async def bench(self, query, room_id, connections, queries):
+        latencies = []
+
+        async def connection():
+            for _ in range(queries):
+                started = time.perf_counter()
+                await query(room_id)
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(connection() for _ in range(connections)))
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        return {
+            "rate": len(latencies) / elapsed,
+            "p50": statistics.median(latencies),
+            "p99": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        }
@@ -0,0 +1,140 @@
+import asyncio
+import time
+import uuid
+
+from channels.layers import InMemoryChannelLayer
+from django.core.management.base import BaseCommand
+
+from chat import fanout
+
+# channels_redis 4.x group_send: ZREMRANGEBYSCORE + ZRANGE on the group key,
+# one pipelined expiry sweep of the member channels and one EVAL per shard.
+REDIS_ROUND_TRIPS_PER_GROUP_SEND = 4
+
+
+class CountingLayer:
+    """Proxy that counts group_send calls made through a channel layer."""
+
+    def __init__(self, layer):
+        self.layer = layer
+        self.group_sends = 0
+
+    async def group_send(self, group, message):
+        self.group_sends += 1
+        await self.layer.group_send(group, message)
+
+    def __getattr__(self, name):
+        return getattr(self.layer, name)
+
+
+class Command(BaseCommand):
+    help = "Compare channel-layer cost per chat message for room vs per-user fan-out."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--participants", type=int, nargs="+", default=[2, 50, 500],
+            help="Room sizes to benchmark.",
+        )
+        parser.add_argument(
+            "--messages", type=int, default=200,
+            help="Messages sent per room size and mode.",
+        )
+        parser.add_argument(
+            "--redis-url", default=None,
+            help="Run against this Redis (e.g. redis://127.0.0.1:6379) "
+                 "instead of the in-memory channel layer.",
+        )
+
+    def handle(self, *args, **options):
+        asyncio.run(self.run(options))
+
+    async def run(self, options):
+        redis_url = options["redis_url"]
+        messages = options["messages"]
+
+        header = f"{'participants':>12} {'mode':>9} {'group_send/msg':>15} {'redis RTT/msg':>14}"
+        if redis_url:
+            header += f" {'redis cmds/msg':>15}"
+        header += f" {'us/msg':>9}"
+        self.stdout.write(header)
+
+        for size in options["participants"]:
+            for mode in ("per_user", "room"):
+                layer = self.make_layer(redis_url, capacity=messages + 10)
+                result = await self.bench(layer, redis_url, size, mode, messages)
+
+                line = (
+                    f"{size:>12} {mode:>9} "
+                    f"{result['group_sends'] / messages:>15.1f} "
+                    f"{result['group_sends'] * REDIS_ROUND_TRIPS_PER_GROUP_SEND / messages:>14.1f}"
+                )
+                if redis_url:
+                    line += f" {result['redis_commands'] / messages:>15.1f}"
+                line += f" {result['elapsed'] * 1e6 / messages:>9.0f}"
+                self.stdout.write(line)
+
+    def make_layer(self, redis_url, capacity):
+        if not redis_url:
+            return InMemoryChannelLayer(capacity=capacity)
+
+        from channels_redis.core import RedisChannelLayer
+
+        return RedisChannelLayer(
+            hosts=[redis_url],
+            prefix=f"bench_fanout_{uuid.uuid4().hex[:8]}",
+            capacity=capacity,
+        )
+
+    async def bench(self, layer, redis_url, size, mode, messages):
+        room_id = 1
+        user_ids = list(range(1, size + 1))
+
+        channels = []
+        for user_id in user_ids:
+            channel = await layer.new_channel()
+            await layer.group_add(fanout.user_group(room_id, user_id), channel)
+            if mode == "room":
+                await layer.group_add(fanout.room_group(room_id), channel)
+            channels.append(channel)
+
+        counting = CountingLayer(layer)
+        event = {
+            "type": "chat_message",
+            "id": 0,
+            "encrypted_text": "x" * 256,
+            "key_version": 1,
+            "user": "bench",
+            "timestamp": "",
+        }
+
+        before = await self.redis_commands(redis_url)
+        started = time.perf_counter()
+        for i in range(messages):
+            event["id"] = i
+            await fanout.publish(counting, room_id, user_ids, event, mode=mode)
+        elapsed = time.perf_counter() - started
+        after = await self.redis_commands(redis_url)
+
+        if redis_url:
+            await layer.flush()
+            await layer.close_pools()
+
+        return {
+            "group_sends": counting.group_sends,
+            # the INFO call itself is counted once
+            "redis_commands": after - before - 1,
+            "elapsed": elapsed,
+        }
+
+    async def redis_commands(self, redis_url):
+        if not redis_url:
+            return 0
+
+        from redis import asyncio as aioredis
+
+        client = aioredis.Redis.from_url(redis_url)
+        try:
+            stats = await client.info("stats")
+        finally:
+            await client.aclose()
+        return stats["total_commands_processed"]
@@ -0,0 +1,93 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from chat.models import Message, UserProfile
+from chat.pagination import MessageKeysetPagination
+from chat.views import MessageViewSet, RoomKeyForUserViewSet
+
+
+class Command(BaseCommand):
+    help = (
+        "Print EXPLAIN plans for the MessageViewSet and RoomKeyForUserViewSet "
+        "hot queries, to check they use the composite indexes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--profile-id", type=int, help="UserProfile to query as.")
+        parser.add_argument("--room-id", type=int, help="Room to query.")
+        parser.add_argument(
+            "--analyze", action="store_true",
+            help="Run EXPLAIN ANALYZE (PostgreSQL only).",
+        )
+
+    def handle(self, *args, **options):
+        profile = self.get_profile(options["profile_id"])
+        room_id = options["room_id"] or (
+            profile.participant_rooms.values_list("id", flat=True).first()
+        )
+        if room_id is None:
+            raise CommandError("Profile is not in any room; pass --room-id.")
+
+        explain_options = {}
+        if options["analyze"] and connection.vendor == "postgresql":
+            explain_options["analyze"] = True
+
+        self.stdout.write(f"Database: {connection.vendor}")
+        self.stdout.write(f"Profile: {profile.id}  Room: {room_id}\n")
+
+        for title, queryset in self.queries(profile, room_id):
+            self.stdout.write(self.style.MIGRATE_HEADING(title))
+            self.stdout.write(str(queryset.query))
+            self.stdout.write(queryset.explain(**explain_options))
+            self.stdout.write("")
+
+    def get_profile(self, profile_id):
+        profiles = UserProfile.objects.select_related("user")
+        if profile_id:
+            return profiles.get(id=profile_id)
+
+        profile = profiles.filter(participant_rooms__isnull=False).first()
+        if profile is None:
+            raise CommandError("No profile with rooms found; pass --profile-id.")
+        return profile
+
+    def build_view(self, viewset_class, profile, params):
+        request = APIRequestFactory().get("/", params)
+        force_authenticate(request, user=profile.user)
+        view = viewset_class()
+        view.request = Request(request)
+        view.request.user = profile.user
+        view.format_kwarg = None
+        return view
+
+    def queries(self, profile, room_id):
+        paginator = MessageKeysetPagination()
+        limit = paginator.page_size + 1
+
+        view = self.build_view(MessageViewSet, profile, {"room_id": room_id})
+        messages = view.get_queryset()
+
+        yield "Messages: latest page", paginator.keyset_queryset(messages, {})[:limit]
+
+        newest = (
+            Message.objects.filter(room_id=room_id)
+            .order_by("-timestamp", "-id")
+            .first()
+        )
+        if newest is not None:
+            cursor = paginator.encode_cursor(newest)
+            yield (
+                "Messages: ?before=<cursor>",
+                paginator.keyset_queryset(messages, {"before": cursor})[:limit],
+            )
+            yield (
+                "Messages: ?since_id=<id>",
+                paginator.keyset_queryset(messages, {"since_id": newest.id})[:limit],
+            )
+
+        for params in ({}, {"room_id": room_id}, {"room_id": room_id, "version": 1}):
+            view = self.build_view(RoomKeyForUserViewSet, profile, params)
+            label = ", ".join(f"{k}={v}" for k, v in params.items()) or "all rooms"
+            yield f"Room keys: {label}", view.get_queryset()
@@ -0,0 +1,281 @@
+import asyncio
+import json
+import statistics
+import time
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test.utils import override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from chat.models import Room, UserProfile
+
+User = get_user_model()
+
+LAYERS = {
+    "memory": lambda options: {
+        "BACKEND": "channels.layers.InMemoryChannelLayer",
+        "CONFIG": {"capacity": 10000},
+    },
+    "redis": lambda options: {
+        "BACKEND": "channels_redis.core.RedisChannelLayer",
+        "CONFIG": {"hosts": [options["redis_url"]], "capacity": 10000},
+    },
+}
+
+
+class CommunicatorConnection:
+    """In-process connection straight into the ASGI application."""
+
+    def __init__(self, path):
+        from channels.testing import WebsocketCommunicator
+        from chat_backend.asgi import application
+
+        self.communicator = WebsocketCommunicator(application, path)
+
+    async def connect(self):
+        connected, _ = await self.communicator.connect(timeout=10)
+        return connected
+
+    async def send(self, text):
+        await self.communicator.send_to(text_data=text)
+
+    async def recv(self, timeout):
+        return await self.communicator.receive_from(timeout=timeout)
+
+    async def close(self):
+        await self.communicator.disconnect()
+
+
+class SocketConnection:
+    """Real WebSocket connection to a running Daphne/uvicorn server."""
+
+    def __init__(self, url):
+        self.url = url
+        self.socket = None
+
+    async def connect(self):
+        import websockets
+
+        try:
+            self.socket = await websockets.connect(self.url, open_timeout=10)
+        except Exception:
+            return False
+        return True
+
+    async def send(self, text):
+        await self.socket.send(text)
+
+    async def recv(self, timeout):
+        return await asyncio.wait_for(self.socket.recv(), timeout)
+
+    async def close(self):
+        await self.socket.close()
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test ws/chat/<room_id>/: create users and rooms, open concurrent "
+        "JWT-authenticated connections, send at a fixed rate and report "
+        "end-to-end delivery latency and throughput."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=50)
+        parser.add_argument("--rooms", type=int, default=5)
+        parser.add_argument(
+            "--connections", type=int, default=50,
+            help="Concurrent WebSocket connections (users are reused round-robin).",
+        )
+        parser.add_argument(
+            "--rate", type=float, default=2.0,
+            help="Messages per second sent by each connection.",
+        )
+        parser.add_argument("--duration", type=float, default=10.0, help="Seconds.")
+        parser.add_argument("--payload-size", type=int, default=256)
+        parser.add_argument(
+            "--layer", choices=["memory", "redis", "settings"], default="memory",
+            help="Channel layer for in-process runs (ignored with --url).",
+        )
+        parser.add_argument("--redis-url", default="redis://127.0.0.1:6379")
+        parser.add_argument(
+            "--url", default=None,
+            help="Base ws:// URL of a running server; default runs in-process.",
+        )
+        parser.add_argument(
+            "--keep-data", action="store_true",
+            help="Don't delete the generated users and rooms afterwards.",
+        )
+
+    def handle(self, *args, **options):
+        if options["users"] < 1 or options["rooms"] < 1 or options["connections"] < 1:
+            raise CommandError("--users, --rooms and --connections must be positive.")
+
+        run_id = uuid.uuid4().hex[:8]
+        plan = self.setup_data(run_id, options)
+        self.stdout.write(
+            f"Run {run_id}: {options['users']} users, {options['rooms']} rooms, "
+            f"{options['connections']} connections, {options['rate']} msg/s each "
+            f"for {options['duration']}s"
+        )
+
+        try:
+            if options["url"] or options["layer"] == "settings":
+                stats = asyncio.run(self.run(plan, options))
+            else:
+                layer = LAYERS[options["layer"]](options)
+                with override_settings(CHANNEL_LAYERS={"default": layer}):
+                    stats = asyncio.run(self.run(plan, options))
+        finally:
+            if not options["keep_data"]:
+                self.cleanup(run_id)
+
+        self.report(stats, options)
+
+    # ---------------------------
+    # Fixtures
+    # ---------------------------
+    @transaction.atomic
+    def setup_data(self, run_id, options):
+        users = User.objects.bulk_create([
+            User(username=f"loadtest_{run_id}_{i}", password="!")
+            for i in range(options["users"])
+        ])
+        profiles = UserProfile.objects.bulk_create([
+            UserProfile(user=user) for user in users
+        ])
+        rooms = [
+            Room.objects.create(
+                name=f"loadtest_{run_id}_{j}",
+                is_group=True,
+                admin=profiles[j % len(profiles)],
+            )
+            for j in range(options["rooms"])
+        ]
+        Room.participants.through.objects.bulk_create([
+            Room.participants.through(
+                room_id=rooms[i % len(rooms)].id, userprofile_id=profile.id
+            )
+            for i, profile in enumerate(profiles)
+        ])
+
+        tokens = [str(AccessToken.for_user(user)) for user in users]
+        return [
+            {
+                "room_id": rooms[(k % len(users)) % len(rooms)].id,
+                "token": tokens[k % len(users)],
+            }
+            for k in range(options["connections"])
+        ]
+
+    def cleanup(self, run_id):
+        with transaction.atomic():
+            Room.objects.filter(name__startswith=f"loadtest_{run_id}_").delete()
+            User.objects.filter(username__startswith=f"loadtest_{run_id}_").delete()
+
+    # ---------------------------
+    # Load generation
+    # ---------------------------
+    def make_connection(self, entry, options):
+        path = f"ws/chat/{entry['room_id']}/?token={entry['token']}"
+        if options["url"]:
+            return SocketConnection(f"{options['url'].rstrip('/')}/{path}")
+        return CommunicatorConnection(f"/{path}")
+
+    async def run(self, plan, options):
+        connections = [self.make_connection(entry, options) for entry in plan]
+        connected = await asyncio.gather(*(c.connect() for c in connections))
+        if not all(connected):
+            raise CommandError(f"{connected.count(False)} connections were rejected.")
+
+        per_room = {}
+        for entry in plan:
+            per_room[entry["room_id"]] = per_room.get(entry["room_id"], 0) + 1
+
+        stats = {"sent": 0, "expected": 0, "rate_limited": 0, "latencies": []}
+        stop = asyncio.Event()
+        receivers = [
+            asyncio.create_task(
+                self.receive_loop(c, stats, per_room[entry["room_id"]], stop)
+            )
+            for c, entry in zip(connections, plan)
+        ]
+
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            self.send_loop(c, entry, k, stats, per_room, options)
+            for k, (c, entry) in enumerate(zip(connections, plan))
+        ))
+        stats["send_elapsed"] = time.perf_counter() - started
+
+        # Give in-flight deliveries a moment to drain
+        deadline = time.perf_counter() + 5
+        while len(stats["latencies"]) < stats["expected"] and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+        stats["elapsed"] = time.perf_counter() - started
+
+        stop.set()
+        await asyncio.gather(*receivers, return_exceptions=True)
+        await asyncio.gather(*(c.close() for c in connections), return_exceptions=True)
+        return stats
+
+    async def send_loop(self, connection, entry, index, stats, per_room, options):
+        interval = 1 / options["rate"]
+        padding = "x" * options["payload_size"]
+        deadline = time.perf_counter() + options["duration"]
+        # Spread the connections over the first interval
+        next_send = time.perf_counter() + interval * index / options["connections"]
+
+        while next_send < deadline:
+            await asyncio.sleep(max(0, next_send - time.perf_counter()))
+            await connection.send(json.dumps({
+                "encrypted_text": f"{time.perf_counter()}|{padding}",
+            }))
+            stats["sent"] += 1
+            stats["expected"] += per_room[entry["room_id"]]
+            next_send += interval
+
+    async def receive_loop(self, connection, stats, room_size, stop):
+        while not stop.is_set():
+            try:
+                text = await connection.recv(timeout=0.5)
+            except (asyncio.TimeoutError, TimeoutError):
+                continue
+            except Exception:
+                return
+
+            event = json.loads(text)
+            if event.get("type") == "rate_limited":
+                # Dropped by CHAT_RATE_LIMITS: nobody will receive it
+                stats["rate_limited"] += 1
+                stats["expected"] -= room_size
+                continue
+            if event.get("type") != "chat_message":
+                continue
+            sent_at = float(event["encrypted_text"].split("|", 1)[0])
+            stats["latencies"].append(time.perf_counter() - sent_at)
+
+    # ---------------------------
+    # Report
+    # ---------------------------
+    def report(self, stats, options):
+        latencies = stats["latencies"]
+        delivered = len(latencies)
+
+        self.stdout.write("")
+        self.stdout.write(f"sent:            {stats['sent']}")
+        self.stdout.write(f"rate limited:    {stats['rate_limited']}")
+        self.stdout.write(f"delivered:       {delivered} / {stats['expected']} expected")
+        self.stdout.write(f"send rate:       {stats['sent'] / stats['send_elapsed']:.1f} msg/s")
+        self.stdout.write(f"delivery rate:   {delivered / stats['elapsed']:.1f} msg/s")
+
+        if len(latencies) < 2:
+            self.stdout.write(self.style.WARNING("Not enough deliveries for percentiles."))
+            return
+
+        cuts = statistics.quantiles(latencies, n=100)
+        for label, value in (("p50", cuts[49]), ("p95", cuts[94]), ("p99", cuts[98])):
+            self.stdout.write(f"latency {label}:     {value * 1000:.2f} ms")
+        self.stdout.write(f"latency max:     {max(latencies) * 1000:.2f} ms")
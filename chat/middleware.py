@@ -1,23 +1,108 @@
+import time
+from collections import OrderedDict
 from urllib.parse import parse_qs
+
+from django.conf import settings
+from rest_framework_simplejwt.exceptions import TokenError
 from rest_framework_simplejwt.tokens import AccessToken
 from django.contrib.auth.models import AnonymousUser
-from channels.db import database_sync_to_async
 
-@database_sync_to_async
-def get_user(token):
+from .db import db_async
+
+
+class TokenUserCache:
+    """
+    Bounded LRU of already verified access tokens -> (user, profile).
+    Entries expire with the token (or after ``ttl`` seconds, if sooner),
+    so reconnect storms don't re-verify and re-query for every handshake.
+    Only touched from the event loop, so no locking is needed.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+
+    def get(self, token):
+        entry = self.entries.get(token)
+        if entry is None:
+            return None
+
+        user, profile, expires_at = entry
+        if expires_at <= time.time():
+            del self.entries[token]
+            return None
+
+        self.entries.move_to_end(token)
+        return user, profile
+
+    def set(self, token, user, profile, token_exp):
+        if self.maxsize <= 0:
+            return
+
+        expires_at = min(token_exp, time.time() + self.ttl)
+        self.entries[token] = (user, profile, expires_at)
+        self.entries.move_to_end(token)
+
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+
+token_cache = TokenUserCache(
+    maxsize=getattr(settings, "CHAT_WS_AUTH_CACHE_SIZE", 10000),
+    ttl=getattr(settings, "CHAT_WS_AUTH_CACHE_TTL", 300),
+)
+
+
+@db_async
+def get_user_and_profile(user_id):
+    """
+    Resolve the user and their UserProfile in one query.
+    """
+    from django.contrib.auth import get_user_model
+    from .models import UserProfile
+
+    profile = (
+        UserProfile.objects
+        .select_related("user")
+        .filter(user_id=user_id)
+        .first()
+    )
+    if profile is not None:
+        return profile.user, profile
+
+    User = get_user_model()
+    try:
+        return User.objects.get(id=user_id), None
+    except User.DoesNotExist:
+        return AnonymousUser(), None
+
+
+async def get_user(token):
+    cached = token_cache.get(token)
+    if cached is not None:
+        return cached
+
     try:
         access_token = AccessToken(token)
-        user = access_token.payload.get('user_id')
-        from django.contrib.auth import get_user_model
-        User = get_user_model()
-        return User.objects.get(id=user)
-    except Exception:
-        return AnonymousUser()
+    except TokenError:
+        return AnonymousUser(), None
+
+    user, profile = await get_user_and_profile(
+        access_token.payload.get('user_id')
+    )
+    if user.is_authenticated:
+        token_cache.set(token, user, profile, access_token["exp"])
+    return user, profile
+
 
 class TokenAuthMiddleware:
     """
     Custom middleware that takes JWT from query string (?token=...)
-    and attaches user to scope['user']
+    and attaches user (and their UserProfile) to scope['user'] / scope['profile']
     """
     def __init__(self, inner):
         self.inner = inner
@@ -26,8 +111,9 @@ class TokenAuthMiddleware:
         query_string = scope.get("query_string", b"").decode()
         token = parse_qs(query_string).get("token")
         if token:
-            scope["user"] = await get_user(token[0])
+            scope["user"], scope["profile"] = await get_user(token[0])
         else:
             scope["user"] = AnonymousUser()
+            scope["profile"] = None
 
         return await self.inner(scope, receive, send)
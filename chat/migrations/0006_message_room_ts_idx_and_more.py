@@ -0,0 +1,25 @@
+# Generated by Django 5.2.7 on 2026-10-17 07:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_message_encrypted_for_receiver_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['room', 'timestamp', 'id'], name='message_room_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='roomkeyforuser',
+            index=models.Index(fields=['user', 'room', '-version', '-created_at'], name='roomkey_user_room_ver_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='roomkeyforuser',
+            index=models.Index(fields=['user', '-version', '-created_at'], name='roomkey_user_ver_idx'),
+        ),
+    ]
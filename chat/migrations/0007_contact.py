@@ -0,0 +1,58 @@
+# Generated by Django 5.2.7 on 2026-10-17 07:30
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_message_room_ts_idx_and_more'),
+    ]
+
+    operations = [
+        # Adopt the existing auto-created through table as Contact; only
+        # the migration state changes here.
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='Contact',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('owner', models.ForeignKey(db_column='from_userprofile_id', on_delete=django.db.models.deletion.CASCADE, related_name='contact_links', to='chat.userprofile')),
+                        ('contact', models.ForeignKey(db_column='to_userprofile_id', on_delete=django.db.models.deletion.CASCADE, related_name='contact_of_links', to='chat.userprofile')),
+                    ],
+                    options={
+                        'db_table': 'chat_userprofile_contacts',
+                        'unique_together': {('owner', 'contact')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='userprofile',
+                    name='contacts',
+                    field=models.ManyToManyField(blank=True, related_name='contacted_by', through='chat.Contact', through_fields=('owner', 'contact'), to='chat.userprofile'),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='contact',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='contact',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='contact',
+            name='removed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='contact',
+            index=models.Index(fields=['owner', 'updated_at', 'id'], name='contact_owner_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.7 on 2026-10-17 07:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_contact'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoomReadCursor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_read_message_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['room', 'id'], name='message_room_id_idx'),
+        ),
+        migrations.AddField(
+            model_name='roomreadcursor',
+            name='room',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_cursors', to='chat.room'),
+        ),
+        migrations.AddField(
+            model_name='roomreadcursor',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_cursors', to='chat.userprofile'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='roomreadcursor',
+            unique_together={('room', 'user')},
+        ),
+    ]
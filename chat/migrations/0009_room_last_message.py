@@ -0,0 +1,28 @@
+# Generated by Django 5.2.7 on 2026-10-17 07:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0008_roomreadcursor_message_room_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='last_activity_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='room',
+            name='last_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chat.message'),
+        ),
+        migrations.AddIndex(
+            model_name='room',
+            index=models.Index(fields=['-last_activity_at'], name='room_last_activity_idx'),
+        ),
+    ]
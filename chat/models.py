@@ -10,12 +10,62 @@ class UserProfile(models.Model):
         User, on_delete=models.CASCADE, related_name="userprofile"
     )
     contacts = models.ManyToManyField(
-        "self", blank=True, symmetrical=False, related_name="contacted_by"
+        "self",
+        blank=True,
+        symmetrical=False,
+        related_name="contacted_by",
+        through="Contact",
+        through_fields=("owner", "contact"),
     )
 
     def __str__(self):
         return self.user.username
 
+    def active_contacts(self):
+        """Contacts not removed (``contacts`` also holds tombstones)."""
+        return (
+            UserProfile.objects
+            .filter(
+                contact_of_links__owner=self,
+                contact_of_links__removed_at__isnull=True,
+            )
+            .select_related("user")
+        )
+
+
+class Contact(models.Model):
+    """
+    One direction of a contact relation. Removing a contact only sets
+    removed_at, so delta syncs (?changed_since=) see removals too.
+    Uses the table of the former auto-created contacts through model.
+    """
+    owner = models.ForeignKey(
+        UserProfile,
+        on_delete=models.CASCADE,
+        related_name="contact_links",
+        db_column="from_userprofile_id",
+    )
+    contact = models.ForeignKey(
+        UserProfile,
+        on_delete=models.CASCADE,
+        related_name="contact_of_links",
+        db_column="to_userprofile_id",
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    removed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = "chat_userprofile_contacts"
+        unique_together = ("owner", "contact")
+        indexes = [
+            # Contact list delta sync: owner, keyset on (updated_at, id)
+            models.Index(
+                fields=["owner", "updated_at", "id"],
+                name="contact_owner_updated_idx",
+            ),
+        ]
+
 
 class Room(models.Model):
     name = models.CharField(max_length=60, unique=True)
@@ -32,6 +82,25 @@ class Room(models.Model):
     is_group = models.BooleanField(default=False)
     key_version = models.IntegerField(default=1)
 
+    # Denormalized newest message, maintained by activity.record_last_messages
+    last_message = models.ForeignKey(
+        "Message",
+        null=True,
+        blank=True,
+        related_name="+",
+        on_delete=models.SET_NULL,
+    )
+    last_activity_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Rooms ordered by recent activity (inbox)
+            models.Index(
+                fields=["-last_activity_at"],
+                name="room_last_activity_idx",
+            ),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -56,6 +125,17 @@ class RoomKeyForUser(models.Model):
     class Meta:
         unique_together = ("room", "user", "version")
         ordering = ["-version", "-created_at"]
+        indexes = [
+            # RoomKeyForUserViewSet: user (+ room, + version), newest first
+            models.Index(
+                fields=["user", "room", "-version", "-created_at"],
+                name="roomkey_user_room_ver_idx",
+            ),
+            models.Index(
+                fields=["user", "-version", "-created_at"],
+                name="roomkey_user_ver_idx",
+            ),
+        ]
 
 
 class Message(models.Model):
@@ -73,4 +153,55 @@ class Message(models.Model):
     timestamp = models.DateTimeField(auto_now_add=True)
 
     class Meta:
-        ordering = ["timestamp"]
\ No newline at end of file
+        ordering = ["timestamp"]
+        indexes = [
+            # MessageViewSet keyset pagination on (timestamp, id) per room
+            models.Index(
+                fields=["room", "timestamp", "id"],
+                name="message_room_ts_idx",
+            ),
+            # Replay and inbox unread counts: room + id range
+            models.Index(
+                fields=["room", "id"],
+                name="message_room_id_idx",
+            ),
+        ]
+
+
+class ArchivedMessage(models.Model):
+    """
+    A Message moved out of the hot table by the archive_messages command.
+    Keeps the original id and timestamp; the ciphertext fields are stored
+    as one zlib-compressed JSON blob (see chat/archive.py).
+    """
+    id = models.BigIntegerField(primary_key=True)
+    room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name="+")
+    user = models.ForeignKey(UserProfile, on_delete=models.CASCADE, related_name="+")
+    timestamp = models.DateTimeField()
+    payload = models.BinaryField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["timestamp"]
+        indexes = [
+            # Same keyset access paths as Message
+            models.Index(
+                fields=["room", "timestamp", "id"],
+                name="archmsg_room_ts_idx",
+            ),
+            models.Index(
+                fields=["room", "id"],
+                name="archmsg_room_id_idx",
+            ),
+        ]
+
+
+class RoomReadCursor(models.Model):
+    """Last message a user has read in a room (inbox unread counts)."""
+    room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name="read_cursors")
+    user = models.ForeignKey(UserProfile, on_delete=models.CASCADE, related_name="read_cursors")
+    last_read_message_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ("room", "user")
@@ -0,0 +1,280 @@
+# pagination.py
+import base64
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db import models
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class MessageKeysetPagination(BasePagination):
+    """
+    Keyset pagination over (timestamp, id) for chat history.
+
+    ?limit=N              newest N messages
+    ?before=<cursor>      N messages older than the cursor
+    ?after=<cursor>       N messages newer than the cursor
+    ?since_id=<id>        messages with a higher id (reconnect sync)
+
+    Results are always returned oldest first. ``previous`` / ``next`` link
+    to the older / newer page and are null when there is nothing there.
+    Pages continue transparently into archived history (see read_through).
+
+    Opt-in: without any of those parameters the view returns its plain,
+    unpaginated list of (hot) messages, so existing clients keep working.
+    """
+
+    page_size = getattr(settings, "CHAT_MESSAGES_PAGE_SIZE", 50)
+    max_page_size = getattr(settings, "CHAT_MESSAGES_MAX_PAGE_SIZE", 200)
+    invalid_cursor_message = "Invalid cursor"
+    cursor_field = "timestamp"
+    opt_in_params = ("limit", "before", "after", "since_id")
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.opt_in_params and not any(
+            param in request.query_params for param in self.opt_in_params
+        ):
+            return None
+
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.limit = self.get_limit(request)
+
+        queryset = self.keyset_queryset(queryset, request.query_params)
+
+        results = list(queryset[:self.limit + 1])
+        results = self.read_through(results, request, view)
+        self.has_more = len(results) > self.limit
+        results = results[:self.limit]
+
+        if self.mode in ("before", "latest"):
+            results.reverse()
+
+        self.page = results
+        return results
+
+    def keyset_queryset(self, queryset, params):
+        """
+        Apply the cursor filter and ordering for ``params`` without
+        evaluating the queryset (also used by the explain_hot_queries command).
+        """
+        before = params.get("before")
+        after = params.get("after")
+        since_id = params.get("since_id")
+
+        if since_id is not None:
+            self.mode = "since"
+            try:
+                since_id = int(since_id)
+            except ValueError:
+                raise NotFound(self.invalid_cursor_message)
+            queryset = queryset.filter(id__gt=since_id).order_by("id")
+        elif after:
+            self.mode = "after"
+            timestamp, pk = self.decode_cursor(after)
+            # The redundant timestamp__gte bound gives the planner an index
+            # range on (room, timestamp, id) instead of an OR filter.
+            queryset = queryset.filter(
+                models.Q(timestamp__gte=timestamp),
+                models.Q(timestamp__gt=timestamp) | models.Q(id__gt=pk),
+            ).order_by("timestamp", "id")
+        elif before:
+            self.mode = "before"
+            timestamp, pk = self.decode_cursor(before)
+            # The redundant timestamp__lte bound gives the planner an index
+            # range on (room, timestamp, id) instead of an OR filter.
+            queryset = queryset.filter(
+                models.Q(timestamp__lte=timestamp),
+                models.Q(timestamp__lt=timestamp) | models.Q(id__lt=pk),
+            ).order_by("-timestamp", "-id")
+        else:
+            self.mode = "latest"
+            queryset = queryset.order_by("-timestamp", "-id")
+
+        return queryset
+
+    def read_through(self, results, request, view):
+        """
+        Merge in rows from the view's cold tier (``get_archive_queryset``,
+        e.g. ArchivedMessage) when the page may reach into it.
+
+        Archived rows are older than hot ones, so paging back (before /
+        latest) only touches the archive once the hot rows run out. Paging
+        forward (after / since_id) always queries it too; once the cursor is
+        past the archive that is an empty index range.
+        """
+        get_archive_queryset = getattr(view, "get_archive_queryset", None)
+        if get_archive_queryset is None:
+            return results
+
+        backward = self.mode in ("before", "latest")
+        if backward and len(results) > self.limit:
+            return results
+
+        archived = self.keyset_queryset(get_archive_queryset(), request.query_params)
+        archived = [view.unpack_archived(row) for row in archived[:self.limit + 1]]
+        if not archived:
+            return results
+
+        if self.mode == "since":
+            key = lambda obj: obj.id
+        else:
+            key = lambda obj: (getattr(obj, self.cursor_field), obj.id)
+        results = sorted(results + archived, key=key, reverse=backward)
+        return results[:self.limit + 1]
+
+    def get_paginated_response(self, data):
+        return Response({
+            "previous": self.get_previous_link(),
+            "next": self.get_next_link(),
+            "results": data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "previous": {"type": "string", "nullable": True, "format": "uri"},
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+    def get_limit(self, request):
+        try:
+            limit = int(request.query_params.get("limit", self.page_size))
+        except ValueError:
+            return self.page_size
+        return max(1, min(limit, self.max_page_size))
+
+    # ---------------------------
+    # Links
+    # ---------------------------
+    def get_previous_link(self):
+        if not self.page:
+            return None
+        if self.mode in ("before", "latest") and not self.has_more:
+            return None
+        return self.build_link("before", self.encode_cursor(self.page[0]))
+
+    def get_next_link(self):
+        if self.mode == "since":
+            if not self.has_more:
+                return None
+            return self.build_link("since_id", self.page[-1].id)
+
+        if not self.page or self.mode == "latest":
+            return None
+        if self.mode == "after" and not self.has_more:
+            return None
+        return self.build_link("after", self.encode_cursor(self.page[-1]))
+
+    def build_link(self, param, value):
+        url = self.base_url
+        for name in ("before", "after", "since_id"):
+            url = remove_query_param(url, name)
+        return replace_query_param(url, param, value)
+
+    # ---------------------------
+    # Cursor encoding
+    # ---------------------------
+    def encode_cursor(self, obj):
+        raw = f"{getattr(obj, self.cursor_field).isoformat()}|{obj.id}"
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+            timestamp, pk = raw.rsplit("|", 1)
+            return datetime.fromisoformat(timestamp), int(pk)
+        except (TypeError, ValueError, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+
+class RoomKeyPagination(LimitOffsetPagination):
+    """
+    Opt-in: only paginates when ?limit= is given, so existing clients
+    still receive a plain list.
+    """
+
+    default_limit = None
+    max_limit = 200
+
+
+class ContactSyncPagination(MessageKeysetPagination):
+    """
+    Keyset pagination over (updated_at, id) for the contact list, oldest
+    change first.
+
+    ?limit=N                  first N contacts
+    ?changed_since=<iso>      contacts added or removed after that time
+                              (removed ones included as tombstones)
+    ?after=<cursor>           continue from the previous page
+
+    ``sync_token`` is the changed_since value to use for the next sync.
+    """
+
+    page_size = getattr(settings, "CHAT_CONTACTS_PAGE_SIZE", 200)
+    max_page_size = getattr(settings, "CHAT_CONTACTS_MAX_PAGE_SIZE", 1000)
+    cursor_field = "updated_at"
+    # Always paginated
+    opt_in_params = ()
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.changed_since = self.get_changed_since(request.query_params)
+        if self.changed_since is not None:
+            queryset = queryset.filter(updated_at__gt=self.changed_since)
+        return super().paginate_queryset(queryset, request, view)
+
+    def keyset_queryset(self, queryset, params):
+        after = params.get("after")
+        self.mode = "after"
+
+        if after:
+            updated_at, pk = self.decode_cursor(after)
+            queryset = queryset.filter(
+                models.Q(updated_at__gte=updated_at),
+                models.Q(updated_at__gt=updated_at) | models.Q(id__gt=pk),
+            )
+        return queryset.order_by("updated_at", "id")
+
+    def get_changed_since(self, params):
+        value = params.get("changed_since")
+        if not value:
+            return None
+        try:
+            changed_since = datetime.fromisoformat(value)
+        except ValueError:
+            raise NotFound("Invalid changed_since")
+        if changed_since.tzinfo is None:
+            changed_since = changed_since.replace(tzinfo=timezone.utc)
+        return changed_since
+
+    def get_sync_token(self):
+        if self.page:
+            return self.page[-1].updated_at.isoformat()
+        if self.changed_since is not None:
+            return self.changed_since.isoformat()
+        return None
+
+    def get_paginated_response(self, data):
+        return Response({
+            "next": self.get_next_link(),
+            "sync_token": self.get_sync_token(),
+            "results": data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "sync_token": {"type": "string", "nullable": True},
+                "results": schema,
+            },
+        }
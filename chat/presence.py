@@ -0,0 +1,195 @@
+# presence.py
+import collections
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from . import fanout
+from .db import db_async
+from .models import Contact, Room
+from .notifications import send_batch
+
+# Online state lives in the cache only (Redis when REDIS_URL is set,
+# per-process memory otherwise):
+#   chat:presence:online:<profile>  open connections, expires after
+#                                   CHAT_PRESENCE_TTL without a heartbeat
+#   chat:presence:seen:<profile>    ISO time the profile went offline
+
+
+def online_key(profile_id):
+    return f"chat:presence:online:{profile_id}"
+
+
+def seen_key(profile_id):
+    return f"chat:presence:seen:{profile_id}"
+
+
+def presence_ttl():
+    return getattr(settings, "CHAT_PRESENCE_TTL", 60)
+
+
+# Open connections per profile in this worker, to rebuild this worker's
+# share of an expired online count (see heartbeat).
+local_connections = collections.Counter()
+restoring = set()
+
+
+async def connect(profile_id):
+    """Count a new connection. Returns True if the profile just came online."""
+    key = online_key(profile_id)
+    ttl = presence_ttl()
+    local_connections[profile_id] += 1
+
+    await cache.aadd(key, 0, ttl)
+    try:
+        count = await cache.aincr(key)
+    except ValueError:
+        # Expired between add and incr
+        await cache.aset(key, 1, ttl)
+        count = 1
+    await cache.atouch(key, ttl)
+    return count == 1
+
+
+async def disconnect(profile_id):
+    """
+    Drop a connection. Returns the new last_seen value if it was the
+    profile's last one, else None.
+    """
+    key = online_key(profile_id)
+    local_connections[profile_id] -= 1
+    if local_connections[profile_id] <= 0:
+        del local_connections[profile_id]
+
+    try:
+        count = await cache.adecr(key)
+    except ValueError:
+        count = 0
+
+    if count > 0:
+        return None
+
+    last_seen = timezone.now().isoformat()
+    await cache.adelete(key)
+    await cache.aset(seen_key(profile_id), last_seen, None)
+    return last_seen
+
+
+async def heartbeat(profile_id):
+    """
+    Keep the online entry alive. Returns True if it had expired, i.e. the
+    profile was shown offline and is online again.
+
+    An expired entry is rebuilt from every worker's own open connections:
+    the first worker to notice adds its count, the others add theirs to it.
+    Within a worker only one connection does this.
+    """
+    key = online_key(profile_id)
+    ttl = presence_ttl()
+    if await cache.atouch(key, ttl) or profile_id in restoring:
+        return False
+
+    count = local_connections[profile_id]
+    if count <= 0:
+        return False
+
+    restoring.add(profile_id)
+    try:
+        if await cache.aadd(key, count, ttl):
+            return True
+        try:
+            await cache.aincr(key, count)
+        except ValueError:
+            # Expired again in between
+            await cache.aset(key, count, ttl)
+        return False
+    finally:
+        restoring.discard(profile_id)
+
+
+def get_presence(profile_ids):
+    """
+    {profile_id: {"profile_id", "online", "last_seen"}} from the cache in
+    one round trip; never touches the database.
+    """
+    keys = {}
+    for profile_id in profile_ids:
+        keys[online_key(profile_id)] = profile_id
+        keys[seen_key(profile_id)] = profile_id
+    cached = cache.get_many(keys)
+
+    return {
+        profile_id: {
+            "profile_id": profile_id,
+            "online": bool(cached.get(online_key(profile_id))),
+            "last_seen": cached.get(seen_key(profile_id)),
+        }
+        for profile_id in profile_ids
+    }
+
+
+def visible_profiles(profile_id, profile_ids):
+    """
+    The subset of ``profile_ids`` whose presence ``profile_id`` may see:
+    itself, its active contacts and the members of its rooms.
+    """
+    visible = set(
+        Contact.objects
+        .filter(owner_id=profile_id, contact_id__in=profile_ids, removed_at__isnull=True)
+        .values_list("contact_id", flat=True)
+    )
+    visible.update(
+        Room.participants.through.objects
+        .filter(
+            room__participants=profile_id,
+            userprofile_id__in=profile_ids,
+        )
+        .values_list("userprofile_id", flat=True)
+    )
+    if profile_id in profile_ids:
+        visible.add(profile_id)
+    return visible
+
+
+# ---------------------------
+# Fan-out
+# ---------------------------
+@db_async
+def audience(profile_id):
+    """
+    Groups told about this profile's presence: the contact list sockets
+    of everyone who has it as a contact, and its rooms.
+    """
+    groups = [
+        fanout.notification_group("contacts", owner_id)
+        for owner_id in (
+            Contact.objects
+            .filter(contact_id=profile_id, removed_at__isnull=True)
+            .values_list("owner_id", flat=True)
+        )
+    ]
+
+    room_ids = Room.objects.filter(participants=profile_id).values_list("id", flat=True)
+    if fanout.fanout_mode() == "room":
+        groups += [fanout.room_group(room_id) for room_id in room_ids]
+    else:
+        members = (
+            Room.participants.through.objects
+            .filter(room_id__in=room_ids)
+            .values_list("room_id", "userprofile__user_id")
+        )
+        groups += [fanout.user_group(room_id, user_id) for room_id, user_id in members]
+
+    return list(dict.fromkeys(groups))
+
+
+async def announce(channel_layer, profile_id, online, last_seen=None):
+    event = {
+        "type": "presence",
+        "profile_id": profile_id,
+        "online": online,
+        "last_seen": last_seen,
+    }
+    groups = await audience(profile_id)
+    await send_batch(channel_layer, [(group, event) for group in groups])
@@ -0,0 +1,50 @@
+# public_keys.py
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import UserEncryptionKey
+
+# Cached "this user has no key yet" marker (None can't be told apart
+# from a cache miss).
+NO_KEY = False
+
+
+def cache_key(user_id):
+    return f"chat:public_key:{user_id}"
+
+
+def get_public_keys(user_ids):
+    """
+    Return {user_id: {"user", "public_key", "updated_at"}} for every user
+    in ``user_ids`` that has a key. Served from the cache where possible;
+    all misses are loaded with a single query.
+    """
+    keys = {user_id: cache_key(user_id) for user_id in user_ids}
+    cached = cache.get_many(keys.values())
+
+    found = {}
+    missing = []
+    for user_id, key in keys.items():
+        if key not in cached:
+            missing.append(user_id)
+        elif cached[key] is not NO_KEY:
+            found[user_id] = cached[key]
+
+    if missing:
+        loaded = {
+            row["user"]: row
+            for row in UserEncryptionKey.objects
+            .filter(user_id__in=missing)
+            .values("user", "public_key", "updated_at")
+        }
+        cache.set_many(
+            {keys[user_id]: loaded.get(user_id, NO_KEY) for user_id in missing},
+            timeout=getattr(settings, "CHAT_PUBLIC_KEY_CACHE_TIMEOUT", 3600),
+        )
+        found.update(loaded)
+
+    return found
+
+
+def invalidate_public_key(user_id):
+    cache.delete(cache_key(user_id))
@@ -0,0 +1,86 @@
+# ratelimit.py
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+class TokenBucket:
+    """``rate`` tokens per second, holding at most ``burst``."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def retry_after(self):
+        """Seconds until one token is available."""
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class BucketRegistry:
+    """
+    Bounded LRU of shared buckets (per user, per room). Buckets live in
+    the worker process, so these limits apply per worker. Only touched
+    from the event loop, so no locking is needed.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.buckets = OrderedDict()
+
+    def get(self, key, rate, burst):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(rate, burst)
+            while len(self.buckets) > self.maxsize:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(key)
+        return bucket
+
+
+registry = BucketRegistry(
+    maxsize=getattr(settings, "CHAT_RATE_LIMIT_MAX_KEYS", 10000),
+)
+
+
+def get_limit(scope):
+    """(rate, burst) for "connection", "user" or "room"; None = unlimited."""
+    return getattr(settings, "CHAT_RATE_LIMITS", {}).get(scope)
+
+
+def connection_bucket():
+    limit = get_limit("connection")
+    return TokenBucket(*limit) if limit else None
+
+
+def consume(connection, user_id=None, room_id=None):
+    """
+    Take one token from the connection, user and room buckets (a None
+    key skips that scope). Returns None if the message may be sent, else
+    (scope, retry_after) for the first exhausted bucket; nothing is taken
+    in that case.
+    """
+    buckets = []
+    if connection is not None:
+        buckets.append(("connection", connection))
+    for scope, key in (("user", user_id), ("room", room_id)):
+        limit = get_limit(scope)
+        if limit and key is not None:
+            buckets.append((scope, registry.get((scope, key), *limit)))
+
+    now = time.monotonic()
+    for scope, bucket in buckets:
+        bucket.refill(now)
+        if bucket.tokens < 1:
+            return scope, bucket.retry_after()
+
+    for _, bucket in buckets:
+        bucket.tokens -= 1
+    return None
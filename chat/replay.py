@@ -0,0 +1,86 @@
+# replay.py
+import collections
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+class RoomReplayBuffer:
+    """
+    The most recent chat_message events of one room, in the order this
+    worker delivered them.
+
+    A buffer is only complete while at least one connection to the room
+    stays open in this process (every member connection receives every
+    message of the room), so it is created on the first connect and
+    dropped when the last connection goes away.
+    """
+
+    def __init__(self, maxlen):
+        self.events = collections.deque(maxlen=maxlen)
+        self.ids = set()
+        self.connections = 0
+
+    def record(self, event):
+        # Several connections in this process see the same event
+        if event["id"] in self.ids:
+            return
+        if len(self.events) == self.events.maxlen:
+            self.ids.discard(self.events[0]["id"])
+        self.events.append(event)
+        self.ids.add(event["id"])
+
+    def since(self, last_id):
+        """
+        Events delivered after message ``last_id``, or None if the buffer
+        can't tell (``last_id`` predates or fell out of the buffer).
+        """
+        if last_id not in self.ids:
+            return None
+
+        events = list(self.events)
+        for index, event in enumerate(events):
+            if event["id"] == last_id:
+                return events[index + 1:]
+        return None
+
+
+_buffers = {}
+
+
+def acquire(room_id):
+    buffer = _buffers.get(room_id)
+    if buffer is None:
+        buffer = _buffers[room_id] = RoomReplayBuffer(
+            maxlen=getattr(settings, "CHAT_REPLAY_BUFFER_SIZE", 500)
+        )
+    buffer.connections += 1
+    return buffer
+
+
+def release(room_id):
+    buffer = _buffers.get(room_id)
+    if buffer is None:
+        return
+    buffer.connections -= 1
+    if buffer.connections <= 0:
+        del _buffers[room_id]
+
+
+# ---------------------------
+# Acknowledged positions
+# ---------------------------
+def ack_key(room_id, user_id):
+    return f"chat:ack:{room_id}:{user_id}"
+
+
+async def get_acked(room_id, user_id):
+    return await cache.aget(ack_key(room_id, user_id))
+
+
+async def set_acked(room_id, user_id, message_id):
+    await cache.aset(
+        ack_key(room_id, user_id),
+        message_id,
+        timeout=getattr(settings, "CHAT_ACK_TIMEOUT", 7 * 24 * 3600),
+    )
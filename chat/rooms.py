@@ -0,0 +1,501 @@
+# rooms.py
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import ArchivedMessage, Room, Message
+from . import fanout, ratelimit, replay, writer
+from .activity import record_last_messages
+from .db import db_async
+
+
+def chat_message_event(message, username, is_group):
+    """The chat_message event/frame for a saved Message."""
+    if is_group:
+        return {
+            "type": "chat_message",
+            "room_id": message.room_id,
+            "id": message.id,
+            "encrypted_text": message.encrypted_text,
+            "key_version": message.key_version,
+            "user": username,
+            "timestamp": message.timestamp.isoformat(),
+        }
+
+    return {
+        "type": "chat_message",
+        "room_id": message.room_id,
+        "id": message.id,
+        "encrypted_for_sender": message.encrypted_for_sender,
+        "encrypted_for_receiver": message.encrypted_for_receiver,
+        "user_id": message.user_id,
+        "user": username,
+        "timestamp": message.timestamp.isoformat(),
+    }
+
+
+class RoomSession:
+    """
+    One open room on a WebSocket connection: cached room metadata, group
+    membership, the send path, acks and replay. ChatConsumer holds one
+    session, MultiplexConsumer one per subscribed room.
+
+    Delivery protocol:
+      - every chat_message frame carries a per-session ``seq``
+      - the client acks with {"type": "ack", "seq": N} (cumulative)
+      - on reconnect the client passes last_id=<message id> (or sends
+        {"type": "resume", "last_id": N}); the session replays only the
+        gap, then sends {"type": "replay_done", "count", "truncated"}.
+        Without last_id the last acknowledged message is used.
+
+    {"type": "typing"} frames are relayed to the other members and never
+    stored.
+
+    Chat messages are limited per connection, user and room
+    (CHAT_RATE_LIMITS); a message over the limit is dropped and answered
+    with {"type": "rate_limited", "scope", "retry_after"}.
+
+    ``tag`` is merged into every frame sent to the client.
+    """
+
+    def __init__(self, consumer, room_id, tag=None):
+        self.consumer = consumer
+        self.room_id = int(room_id)
+        self.user = consumer.user
+        self.profile = consumer.profile
+        self.username = consumer.username
+        self.tag = tag or {}
+
+        self.user_group_name = fanout.user_group(self.room_id, self.user.id)
+        self.fanout_group_name = fanout.room_group(self.room_id)
+
+        self.room_state = None
+        self.replay_buffer = None
+        self.seq = 0
+        self.unacked = OrderedDict()
+        self.replayed_ids = set()
+        self.last_live_id = 0
+        self.last_typing_at = 0
+
+    @property
+    def channel_layer(self):
+        return self.consumer.channel_layer
+
+    async def send(self, event, wait=False):
+        await self.consumer.send_event({**event, **self.tag}, wait=wait)
+
+    # =====================================================
+    # Lifecycle
+    # =====================================================
+
+    async def open(self):
+        """
+        Load the room and join its groups. Returns False if the room does
+        not exist or the user is not a member.
+        """
+        # Room metadata is cached for the life of the session and kept
+        # fresh by the room_members_changed / room_key_rotated push events.
+        self.room_state = await self.load_room_state()
+        if not self.room_state or not self.is_member():
+            return False
+
+        await self.channel_layer.group_add(
+            self.user_group_name,
+            self.consumer.channel_name,
+        )
+        await self.join_fanout_group()
+
+        self.replay_buffer = replay.acquire(self.room_id)
+        return True
+
+    async def resume(self, last_id=None):
+        if last_id is None:
+            last_id = await replay.get_acked(self.room_id, self.user.id)
+        if last_id is not None:
+            await self.replay(last_id)
+
+    async def close(self):
+        await self.channel_layer.group_discard(
+            self.user_group_name,
+            self.consumer.channel_name,
+        )
+        await self.channel_layer.group_discard(
+            self.fanout_group_name,
+            self.consumer.channel_name,
+        )
+        if self.replay_buffer is not None:
+            replay.release(self.room_id)
+            self.replay_buffer = None
+
+    # =====================================================
+    # Client frames
+    # =====================================================
+
+    async def receive(self, data):
+        if data.get("type") == "ack":
+            await self.handle_ack(data)
+            return
+        if data.get("type") == "resume":
+            # Each replay may hit the DB: charge it to the connection
+            if await self.check_rate_limit():
+                await self.replay(data.get("last_id"))
+            return
+        if data.get("type") == "typing":
+            await self.handle_typing()
+            return
+
+        if not await self.check_member():
+            return
+
+        if not await self.check_rate_limit(self.user.id, self.room_id):
+            return
+
+        room = self.room_state
+
+        # =====================================================
+        # GROUP CHAT
+        # =====================================================
+        if room["is_group"]:
+            encrypted_text = data.get("encrypted_text")
+            if not encrypted_text:
+                return
+
+            message = await self.create_group_message(
+                encrypted_text=encrypted_text,
+                key_version=room["key_version"],
+            )
+
+            await fanout.publish(
+                self.channel_layer,
+                self.room_id,
+                room["participants"],
+                chat_message_event(message, self.username, is_group=True),
+            )
+
+        # =====================================================
+        # 1-1 CHAT
+        # =====================================================
+        else:
+            enc_sender = data.get("encrypted_for_sender")
+            enc_receiver = data.get("encrypted_for_receiver")
+
+            if not enc_sender or not enc_receiver:
+                return
+
+            message = await self.create_private_message(
+                enc_sender,
+                enc_receiver,
+            )
+
+            await fanout.publish(
+                self.channel_layer,
+                self.room_id,
+                room["participants"],
+                chat_message_event(message, self.username, is_group=False),
+            )
+
+    # =====================================================
+    # Channel layer events
+    # =====================================================
+
+    async def chat_message(self, event):
+        self.replay_buffer.record(dict(event))
+
+        # The room group is shared, so a removed member may still see a
+        # message published before its removal was processed.
+        if self.room_state and not self.is_member():
+            return
+
+        self.last_live_id = max(self.last_live_id, event["id"])
+
+        # Already sent as part of a replay
+        if event["id"] in self.replayed_ids:
+            self.replayed_ids.discard(event["id"])
+            return
+        if self.replayed_ids:
+            # Older replayed ids arrived (or were lost) before this one
+            self.remember_replayed(())
+
+        await self.send_chat_event(event)
+
+    async def send_chat_event(self, event, wait=False):
+        self.seq += 1
+        self.unacked[self.seq] = event["id"]
+        if len(self.unacked) > getattr(settings, "CHAT_UNACKED_LIMIT", 1000):
+            self.unacked.popitem(last=False)
+
+        await self.send({**event, "seq": self.seq}, wait=wait)
+
+    async def room_members_changed(self, event):
+        """
+        Handler for membership edits made through RoomViewSet.
+        Only updates the cached participant set; nothing is sent to the
+        client unless this session's own user was removed.
+        """
+        if not self.room_state:
+            return
+
+        participants = self.room_state["participants"]
+        participants.update(event.get("added", []))
+        participants.difference_update(event.get("removed", []))
+
+        if self.user.id in event.get("removed", []):
+            # Stop receiving room-wide fan-out right away
+            await self.channel_layer.group_discard(
+                self.fanout_group_name,
+                self.consumer.channel_name,
+            )
+            await self.send({
+                "type": "removed"
+            })
+        elif self.user.id in event.get("added", []):
+            await self.join_fanout_group()
+
+    async def join_fanout_group(self):
+        if fanout.fanout_mode() == "room":
+            await self.channel_layer.group_add(
+                self.fanout_group_name,
+                self.consumer.channel_name,
+            )
+
+    async def room_key_rotated(self, event):
+        """
+        Handler for room.key_rotated events
+        """
+        if self.room_state:
+            self.room_state["key_version"] = event["version"]
+
+        await self.send({
+            "type": "room.key_rotated",
+            "version": event["version"],
+        })
+
+    async def typing(self, event):
+        if event["user_id"] == self.user.id:
+            return
+        if self.room_state and not self.is_member():
+            return
+
+        await self.send({
+            "type": "typing",
+            "user_id": event["user_id"],
+            "user": event["user"],
+        })
+
+    # =====================================================
+    # Typing indicators
+    # =====================================================
+
+    async def handle_typing(self):
+        """
+        Relay {"type": "typing"} to the other members. Ephemeral: never
+        stored or replayed, and at most one per CHAT_TYPING_INTERVAL_MS
+        per session; extra frames are dropped.
+        """
+        now = time.monotonic()
+        interval = getattr(settings, "CHAT_TYPING_INTERVAL_MS", 2000) / 1000
+        if now - self.last_typing_at < interval:
+            return
+        self.last_typing_at = now
+
+        if not self.room_state or not self.is_member():
+            return
+
+        await fanout.publish(
+            self.channel_layer,
+            self.room_id,
+            self.room_state["participants"],
+            {
+                "type": "typing",
+                "room_id": self.room_id,
+                "user_id": self.user.id,
+                "user": self.username,
+            },
+        )
+
+    # =====================================================
+    # Acks / replay
+    # =====================================================
+
+    async def handle_ack(self, data):
+        try:
+            seq = int(data.get("seq"))
+        except (TypeError, ValueError):
+            return
+
+        acked_id = None
+        while self.unacked and next(iter(self.unacked)) <= seq:
+            _, message_id = self.unacked.popitem(last=False)
+            acked_id = max(acked_id or 0, message_id)
+
+        if acked_id is not None:
+            await replay.set_acked(self.room_id, self.user.id, acked_id)
+
+    async def replay(self, last_id):
+        try:
+            last_id = int(last_id)
+        except (TypeError, ValueError):
+            return
+
+        # A removed member must not read history it can no longer see
+        if not await self.check_member():
+            return
+
+        limit = getattr(settings, "CHAT_REPLAY_MAX", 200)
+        events = self.replay_buffer.since(last_id)
+        archived = False
+
+        if events is None:
+            # Not covered by this worker's buffer: one indexed range query
+            events, archived = await self.load_events_after(last_id, limit + 1)
+
+        truncated = archived or len(events) > limit
+        events = events[:limit]
+
+        self.remember_replayed(event["id"] for event in events)
+        for event in events:
+            # Wait for outbox room: a replay may exceed the queue size
+            await self.send_chat_event(event, wait=True)
+
+        await self.send({
+            "type": "replay_done",
+            "count": len(events),
+            # More was missed than we replay; refetch over REST (?since_id=)
+            "truncated": truncated,
+        }, wait=True)
+
+    # =====================================================
+    # DB helpers (ALL SAFE)
+    # =====================================================
+
+    def remember_replayed(self, message_ids):
+        """
+        Note replayed ids so their live copies (still queued on the channel
+        layer) are skipped. Ids at or below the newest live message already
+        arrived, and at most CHAT_REPLAY_MAX of the newest ids are kept.
+        """
+        self.replayed_ids.update(
+            message_id for message_id in message_ids
+            if message_id > self.last_live_id
+        )
+        self.replayed_ids = set(sorted(
+            message_id for message_id in self.replayed_ids
+            if message_id > self.last_live_id
+        )[-getattr(settings, "CHAT_REPLAY_MAX", 200):])
+
+    async def check_rate_limit(self, user_id=None, room_id=None):
+        """
+        Charge one frame to the connection (and the given user / room)
+        buckets. Answers rate_limited and returns False when over a limit.
+        """
+        limited = ratelimit.consume(self.consumer.send_bucket, user_id, room_id)
+        if limited is None:
+            return True
+
+        scope, retry_after = limited
+        await self.send({
+            "type": "rate_limited",
+            "scope": scope,
+            "retry_after": round(retry_after, 3),
+        })
+        return False
+
+    def is_member(self):
+        return self.user.id in self.room_state["participants"]
+
+    async def check_member(self):
+        """
+        Reload room metadata if it is stale, then tell the client it was
+        removed (and return False) if the user is no longer a member.
+        """
+        if self.room_state_expired():
+            self.room_state = await self.load_room_state()
+            if self.room_state and self.is_member():
+                # Re-added while a membership event was missed
+                await self.join_fanout_group()
+
+        if not self.room_state or not self.is_member():
+            await self.send({
+                "type": "removed"
+            })
+            return False
+        return True
+
+    def room_state_expired(self):
+        ttl = getattr(settings, "CHAT_ROOM_CACHE_TTL", 300)
+        return time.monotonic() - self.room_state_loaded_at > ttl
+
+    @db_async
+    def load_room_state(self):
+        self.room_state_loaded_at = time.monotonic()
+
+        room = (
+            Room.objects
+            .filter(id=self.room_id)
+            .values("is_group", "key_version")
+            .first()
+        )
+        if room is None:
+            return None
+
+        room["participants"] = set(
+            Room.participants.through.objects
+            .filter(room_id=self.room_id)
+            .values_list("userprofile__user_id", flat=True)
+        )
+        return room
+
+    @db_async
+    def load_events_after(self, last_id, limit):
+        """
+        Up to ``limit`` hot messages after ``last_id``, and whether archived
+        ones were skipped (replay only reads the hot table).
+        """
+        archived = (
+            ArchivedMessage.objects
+            .filter(room_id=self.room_id, id__gt=last_id)
+            .exists()
+        )
+        messages = (
+            Message.objects
+            .filter(room_id=self.room_id, id__gt=last_id)
+            .select_related("user__user")
+            .order_by("id")[:limit]
+        )
+        return [
+            chat_message_event(
+                message, message.user.user.username, self.room_state["is_group"]
+            )
+            for message in messages
+        ], archived
+
+    async def create_group_message(self, encrypted_text, key_version):
+        return await self.save_message(Message(
+            room_id=self.room_id,
+            user=self.profile,
+            encrypted_text=encrypted_text,
+            key_version=key_version,
+        ))
+
+    async def create_private_message(self, enc_sender, enc_receiver):
+        return await self.save_message(Message(
+            room_id=self.room_id,
+            user=self.profile,
+            encrypted_for_sender=enc_sender,
+            encrypted_for_receiver=enc_receiver,
+        ))
+
+    async def save_message(self, message):
+        if writer.batching_enabled():
+            return await writer.get_message_writer().write(message)
+
+        await self.insert_message(message)
+        return message
+
+    @db_async
+    def insert_message(self, message):
+        with transaction.atomic():
+            message.save(force_insert=True)
+            record_last_messages([message])
@@ -1,9 +1,10 @@
 # chat/routing.py
 from django.urls import re_path
-from .consumers import ChatConsumer,GroupConsumer,ContactNotifyConsumer
+from .consumers import ChatConsumer,GroupConsumer,ContactNotifyConsumer,MultiplexConsumer
 
 websocket_urlpatterns = [
     re_path(r'ws/chat/(?P<room_id>\d+)/$', ChatConsumer.as_asgi()),
     re_path(r'ws/contact/$', ContactNotifyConsumer.as_asgi()),
     re_path(r'ws/group/$', GroupConsumer.as_asgi()),
+    re_path(r'ws/mux/$', MultiplexConsumer.as_asgi()),
 ]
\ No newline at end of file
@@ -1,7 +1,7 @@
 # serializers.py
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
-from .models import Room, Message, UserProfile, UserEncryptionKey, RoomKeyForUser
+from .models import Room, Message, UserProfile, Contact, UserEncryptionKey, RoomKeyForUser
 
 User = get_user_model()
 
@@ -39,13 +39,24 @@ class UserProfileMiniSerializer(serializers.ModelSerializer):
 
 class UserProfileSerializer(serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
-    contacts = UserProfileMiniSerializer(many=True, read_only=True)
+    contacts = UserProfileMiniSerializer(
+        many=True, read_only=True, source="active_contacts"
+    )
 
     class Meta:
         model = UserProfile
         fields = ["id", "user", "contacts"]
 
 
+class ContactSerializer(serializers.ModelSerializer):
+    """Contact list sync entry; removed_at is set on tombstones."""
+    contact = UserProfileMiniSerializer(read_only=True)
+
+    class Meta:
+        model = Contact
+        fields = ["contact", "created_at", "updated_at", "removed_at"]
+
+
 class RoomSerializer(serializers.ModelSerializer):
     admin = UserProfileMiniSerializer(read_only=True)
     participants = UserProfileMiniSerializer(many=True, read_only=True)
@@ -67,8 +78,9 @@ class RoomSerializer(serializers.ModelSerializer):
             "participant_ids",
             "created_at",
             "key_version",
+            "last_activity_at",
         ]
-        read_only_fields = ["created_at", "key_version"]
+        read_only_fields = ["created_at", "key_version", "last_activity_at"]
 
 
 # serializers.py
@@ -108,6 +120,29 @@ class MessageSerializer(serializers.ModelSerializer):
             "username": obj.user.user.username,
         }
 
+
+class InboxRoomSerializer(serializers.ModelSerializer):
+    """
+    Sidebar entry for RoomViewSet.inbox. Expects the last_read_id and
+    unread_count annotations added by that action.
+    """
+    last_message = MessageSerializer(read_only=True, allow_null=True)
+    last_read_id = serializers.IntegerField(read_only=True)
+    unread_count = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Room
+        fields = [
+            "id",
+            "name",
+            "is_group",
+            "key_version",
+            "last_activity_at",
+            "last_message",
+            "last_read_id",
+            "unread_count",
+        ]
+
 class UserEncryptionKeySerializer(serializers.ModelSerializer):
     class Meta:
         model = UserEncryptionKey
@@ -139,6 +174,13 @@ class UserEncryptionKeySerializer(serializers.ModelSerializer):
         return key_obj
 
 
+class PublicKeySerializer(serializers.Serializer):
+    """Public half only, for the bulk ?user_ids= directory lookup."""
+    user = serializers.IntegerField()
+    public_key = serializers.CharField()
+    updated_at = serializers.DateTimeField()
+
+
 class RoomKeyForUserSerializer(serializers.ModelSerializer):
     room = serializers.PrimaryKeyRelatedField(
         queryset=Room.objects.all()
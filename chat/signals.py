@@ -0,0 +1,15 @@
+# signals.py
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import UserEncryptionKey
+from .public_keys import invalidate_public_key
+
+
+@receiver([post_save, post_delete], sender=UserEncryptionKey)
+def drop_cached_public_key(sender, instance, **kwargs):
+    # After commit: invalidating inside the transaction would let a
+    # concurrent lookup re-cache the old key before the new one is visible
+    user_id = instance.user_id
+    transaction.on_commit(lambda: invalidate_public_key(user_id))
@@ -1,3 +1,957 @@
-from django.test import TestCase
+import asyncio
+import io
+import itertools
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import fakeredis
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.testing import WebsocketCommunicator
+from channels_redis.core import RedisChannelLayer
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from redis import asyncio as aioredis
+
+from . import fanout, notifications, presence, ratelimit
+from .activity import record_last_messages
+from .framing import OUTBOX_OVERFLOW_CLOSE_CODE, FramedConsumerMixin
+from .models import ArchivedMessage, Contact, Message, Room, UserEncryptionKey, UserProfile
+from .rooms import RoomSession
+from .views import resolve_profiles
+from .writer import MessageWriter
+
+User = get_user_model()
+
+
+def make_profile(username):
+    user = User.objects.create_user(username, f"{username}@example.com")
+    return UserProfile.objects.create(user=user)
+
+
+def create_messages(room, profile, count):
+    messages = [
+        Message.objects.create(
+            room=room, user=profile, encrypted_text=f"m{i}", key_version=1
+        )
+        for i in range(count)
+    ]
+    record_last_messages(messages)
+    return [message.id for message in messages]
+
+
+def archive_messages(message_ids):
+    """Age the given messages past the cutoff and run archive_messages."""
+    old = timezone.now() - timedelta(days=400)
+    for i, message_id in enumerate(message_ids):
+        Message.objects.filter(id=message_id).update(timestamp=old + timedelta(minutes=i))
+    call_command("archive_messages", "--batch-size", "3", stdout=io.StringIO())
+
+
+class ListQueryCountTests(TestCase):
+    """
+    The room and profile list endpoints must use a fixed number of
+    queries no matter how many rooms, participants or contacts there are.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.profile = make_profile("owner")
+        others = [make_profile(f"member{i}") for i in range(10)]
+
+        for i in range(10):
+            room = Room.objects.create(
+                name=f"room{i}", is_group=True, admin=others[i]
+            )
+            room.participants.add(cls.profile, *others)
+
+        cls.profile.contacts.add(*others)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.profile.user)
+
+    def test_room_list_query_count(self):
+        # profile, rooms (+ admin/user), participants (+ user)
+        with self.assertNumQueries(3):
+            response = self.client.get("/api/rooms/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 10)
+        self.assertEqual(len(response.data[0]["participants"]), 11)
+
+    def test_profile_list_query_count(self):
+        # profile (+ user), contacts (+ user)
+        with self.assertNumQueries(2):
+            response = self.client.get("/api/userprofile/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data[0]["contacts"]), 10)
+
+
+@override_settings(
+    CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+)
+class ChatSocketTestCase(TransactionTestCase):
+    """Alice and Bob in one group room, with WebSocket helpers."""
+
+    def setUp(self):
+        self.alice = make_profile("alice")
+        self.bob = make_profile("bob")
+        self.room = Room.objects.create(name="room", is_group=True, admin=self.alice)
+        self.room.participants.add(self.alice, self.bob)
+
+    def connect(self, profile, last_id=None):
+        from chat_backend.asgi import application
+
+        path = f"/ws/chat/{self.room.id}/?token={AccessToken.for_user(profile.user)}"
+        if last_id is not None:
+            path += f"&last_id={last_id}"
+        return WebsocketCommunicator(application, path)
+
+    async def receive(self, communicator):
+        # Presence frames depend on connection order; not under test here
+        while True:
+            frame = await communicator.receive_json_from()
+            if frame["type"] != "presence":
+                return frame
+
+    async def send_messages(self, communicator, count):
+        ids = []
+        for i in range(count):
+            await communicator.send_json_to({"encrypted_text": f"m{i}"})
+            ids.append((await self.receive(communicator))["id"])
+        return ids
+
+    async def receive_replay(self, communicator):
+        frames = []
+        while True:
+            frame = await self.receive(communicator)
+            if frame["type"] == "replay_done":
+                return frames, frame
+            frames.append(frame)
+
+    async def change_members(self, action, *profiles):
+        client = APIClient()
+        client.force_authenticate(self.alice.user)
+        response = await sync_to_async(client.post)(
+            f"/api/rooms/{self.room.id}/{action}/",
+            {"participants_ids": [profile.id for profile in profiles]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+
+
+class ReplayTests(ChatSocketTestCase):
+    """Reconnect replay on ChatConsumer: buffer, database and membership."""
+
+    async def test_resume_from_buffer(self):
+        alice = self.connect(self.alice)
+        await alice.connect()
+        ids = await self.send_messages(alice, 3)
+
+        # Alice's open connection keeps the room's replay buffer alive
+        bob = self.connect(self.bob, last_id=ids[0])
+        await bob.connect()
+        frames, done = await self.receive_replay(bob)
+
+        self.assertEqual([frame["id"] for frame in frames], ids[1:])
+        self.assertEqual(done, {"type": "replay_done", "count": 2, "truncated": False})
+
+        with self.settings(CHAT_REPLAY_MAX=1):
+            await bob.send_json_to({"type": "resume", "last_id": ids[0]})
+            frames, done = await self.receive_replay(bob)
+
+        self.assertEqual([frame["id"] for frame in frames], ids[1:2])
+        self.assertEqual(done, {"type": "replay_done", "count": 1, "truncated": True})
+
+        await alice.disconnect()
+        await bob.disconnect()
+
+    async def test_resume_larger_than_outbox(self):
+        alice = self.connect(self.alice)
+        await alice.connect()
+        ids = await self.send_messages(alice, 8)
+
+        # Replay waits for outbox room instead of tripping the overflow close
+        with self.settings(CHAT_OUTBOUND_QUEUE_SIZE=2):
+            bob = self.connect(self.bob, last_id=ids[0])
+            await bob.connect()
+            frames, done = await self.receive_replay(bob)
+
+        self.assertEqual([frame["id"] for frame in frames], ids[1:])
+        self.assertEqual(done["count"], 7)
+
+        await alice.disconnect()
+        await bob.disconnect()
+
+    async def test_resume_from_database(self):
+        alice = self.connect(self.alice)
+        await alice.connect()
+        ids = await self.send_messages(alice, 3)
+        await alice.disconnect()
+
+        # No open connection: the buffer is gone, replay hits the DB
+        bob = self.connect(self.bob, last_id=0)
+        await bob.connect()
+        frames, done = await self.receive_replay(bob)
+
+        self.assertEqual([frame["id"] for frame in frames], ids)
+        self.assertEqual([frame["seq"] for frame in frames], [1, 2, 3])
+        self.assertEqual(done["count"], 3)
+
+        await bob.disconnect()
+
+    async def test_resume_past_archive(self):
+        ids = await sync_to_async(create_messages)(self.room, self.alice, 4)
+        await sync_to_async(archive_messages)(ids)
+
+        # Replay only reads hot rows: missing archived ones means truncated
+        bob = self.connect(self.bob, last_id=0)
+        await bob.connect()
+        frames, done = await self.receive_replay(bob)
+
+        self.assertEqual([frame["id"] for frame in frames], ids[3:])
+        self.assertTrue(done["truncated"])
+
+        await bob.send_json_to({"type": "resume", "last_id": ids[2]})
+        frames, done = await self.receive_replay(bob)
+
+        self.assertEqual([frame["id"] for frame in frames], ids[3:])
+        self.assertFalse(done["truncated"])
+
+        await bob.disconnect()
+
+    async def test_resume_is_rate_limited(self):
+        with self.settings(CHAT_RATE_LIMITS={"connection": (1, 1)}):
+            bob = self.connect(self.bob)
+            await bob.connect()
+
+            await bob.send_json_to({"type": "resume", "last_id": 0})
+            frames, done = await self.receive_replay(bob)
+            self.assertEqual(done["count"], 0)
+
+            await bob.send_json_to({"type": "resume", "last_id": 0})
+            frame = await self.receive(bob)
+
+        self.assertEqual((frame["type"], frame["scope"]), ("rate_limited", "connection"))
+        await bob.disconnect()
+
+    async def test_resume_after_removal(self):
+        alice = self.connect(self.alice)
+        await alice.connect()
+        bob = self.connect(self.bob)
+        await bob.connect()
+
+        await self.change_members("remove_member", self.bob)
+        self.assertEqual(await self.receive(bob), {"type": "removed"})
+
+        await self.send_messages(alice, 1)
+        await bob.send_json_to({"type": "resume", "last_id": 0})
+
+        self.assertEqual(await self.receive(bob), {"type": "removed"})
+        self.assertTrue(await bob.receive_nothing())
+
+        await alice.disconnect()
+        await bob.disconnect()
+
+
+class FlowControlTests(ChatSocketTestCase):
+    """Inbound rate limits and the outbound queue's overflow policy."""
+
+    def setUp(self):
+        super().setUp()
+        ratelimit.registry.buckets.clear()
+        self.release = asyncio.Event()
+
+        drain_outbox = FramedConsumerMixin.drain_outbox
+
+        async def held_drain(consumer):
+            await self.release.wait()
+            await drain_outbox(consumer)
+
+        patcher = mock.patch.object(FramedConsumerMixin, "drain_outbox", held_drain)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def assert_rate_limited(self, communicator, scope):
+        await communicator.send_json_to({"encrypted_text": "over"})
+        frame = await self.receive(communicator)
+        self.assertEqual((frame["type"], frame["scope"]), ("rate_limited", scope))
+        self.assertGreater(frame["retry_after"], 0)
+
+    async def test_rate_limited_per_scope(self):
+        self.release.set()
+
+        with self.settings(CHAT_RATE_LIMITS={"connection": (0.1, 1)}):
+            alice = self.connect(self.alice)
+            await alice.connect()
+            await self.send_messages(alice, 1)
+            await self.assert_rate_limited(alice, "connection")
+            await alice.disconnect()
+
+        # Shared by all of Alice's connections
+        with self.settings(CHAT_RATE_LIMITS={"user": (0.1, 1)}):
+            first, second = self.connect(self.alice), self.connect(self.alice)
+            await first.connect()
+            await second.connect()
+            await self.send_messages(first, 1)
+            await self.receive(second)
+            await self.assert_rate_limited(second, "user")
+            await first.disconnect()
+            await second.disconnect()
+
+        # Shared by everyone in the room
+        with self.settings(CHAT_RATE_LIMITS={"room": (0.1, 1)}):
+            alice, bob = self.connect(self.alice), self.connect(self.bob)
+            await alice.connect()
+            await bob.connect()
+            await self.send_messages(alice, 1)
+            await self.receive(bob)
+            await self.assert_rate_limited(bob, "room")
+            await alice.disconnect()
+            await bob.disconnect()
+
+    async def test_overflow_closes(self):
+        with self.settings(CHAT_RATE_LIMITS={}, CHAT_OUTBOUND_QUEUE_SIZE=1):
+            alice = self.connect(self.alice)
+            await alice.connect()
+            await alice.send_json_to({"encrypted_text": "m0"})
+            await alice.send_json_to({"encrypted_text": "m1"})
+
+            self.assertEqual(
+                await alice.receive_output(),
+                {"type": "websocket.close", "code": OUTBOX_OVERFLOW_CLOSE_CODE},
+            )
+
+    async def test_overflow_drops(self):
+        with self.settings(
+            CHAT_RATE_LIMITS={},
+            CHAT_OUTBOUND_QUEUE_SIZE=1,
+            CHAT_OUTBOUND_OVERFLOW="drop",
+        ):
+            alice = self.connect(self.alice)
+            await alice.connect()
+            for i in range(3):
+                await alice.send_json_to({"encrypted_text": f"m{i}"})
+            self.assertTrue(await alice.receive_nothing(0.5))
+
+            self.release.set()
+            frame = await self.receive(alice)
+            self.assertEqual(frame["encrypted_text"], "m0")
+            self.assertTrue(await alice.receive_nothing())
+            self.assertEqual(await Message.objects.acount(), 3)
+            await alice.disconnect()
+
+
+class ReplayedIdsTests(SimpleTestCase):
+    """RoomSession only remembers replayed ids that may still arrive live."""
+
+    def make_session(self):
+        consumer = SimpleNamespace(user=SimpleNamespace(id=1), profile=None, username="u")
+        return RoomSession(consumer, room_id=1)
+
+    def test_keeps_newest_replayed_ids(self):
+        session = self.make_session()
+        with self.settings(CHAT_REPLAY_MAX=3):
+            session.remember_replayed(range(1, 11))
+        self.assertEqual(session.replayed_ids, {8, 9, 10})
+
+    def test_drops_ids_older_than_newest_live(self):
+        session = self.make_session()
+        session.last_live_id = 5
+        session.remember_replayed(range(1, 8))
+        self.assertEqual(session.replayed_ids, {6, 7})
+
+        session.last_live_id = 6
+        session.remember_replayed(())
+        self.assertEqual(session.replayed_ids, {7})
+
+
+class MembershipTests(ChatSocketTestCase):
+    """Membership edits over REST reaching already open sockets."""
+
+    async def test_readded_member_receives_again(self):
+        alice = self.connect(self.alice)
+        await alice.connect()
+        bob = self.connect(self.bob)
+        await bob.connect()
+
+        await self.change_members("remove_member", self.bob)
+        self.assertEqual(await self.receive(bob), {"type": "removed"})
+
+        await self.change_members("add_member", self.bob)
+        [message_id] = await self.send_messages(alice, 1)
+
+        frame = await self.receive(bob)
+        self.assertEqual((frame["type"], frame["id"]), ("chat_message", message_id))
+
+        await alice.disconnect()
+        await bob.disconnect()
+
+
+class MessageWriterTests(TransactionTestCase):
+    """Group commit of WebSocket messages (CHAT_MESSAGE_WRITE_BATCHING)."""
+
+    def setUp(self):
+        self.profile = make_profile("owner")
+        self.room = Room.objects.create(name="room", is_group=True, admin=self.profile)
+
+    def message(self, text, user_id=None):
+        return Message(
+            room_id=self.room.id,
+            user_id=user_id or self.profile.id,
+            encrypted_text=text,
+            key_version=1,
+        )
+
+    async def write_all(self, messages):
+        writer = MessageWriter(max_batch=len(messages), max_delay=1)
+        return await asyncio.gather(
+            *(writer.write(message) for message in messages),
+            return_exceptions=True,
+        )
+
+    async def test_batch_returns_saved_messages(self):
+        saved = await self.write_all([self.message(f"m{i}") for i in range(3)])
+
+        self.assertTrue(all(message.id and message.timestamp for message in saved))
+        rows = await sync_to_async(list)(
+            Message.objects.order_by("id").values_list("id", "encrypted_text")
+        )
+        self.assertEqual(rows, [(message.id, message.encrypted_text) for message in saved])
+
+        room = await Room.objects.aget(id=self.room.id)
+        self.assertEqual(room.last_message_id, saved[-1].id)
+
+    async def test_failed_batch_only_fails_bad_row(self):
+        unknown_user = self.profile.id + 100
+        # The batched insert is tried first, then each row on its own
+        with self.assertLogs("chat.writer", "ERROR"):
+            results = await self.write_all([
+                self.message("m0"),
+                self.message("bad", user_id=unknown_user),
+                self.message("m2"),
+            ])
+
+        self.assertIsInstance(results[1], IntegrityError)
+        self.assertEqual([results[0].encrypted_text, results[2].encrypted_text], ["m0", "m2"])
+        self.assertEqual(
+            await sync_to_async(list)(
+                Message.objects.order_by("id").values_list("encrypted_text", flat=True)
+            ),
+            ["m0", "m2"],
+        )
+
+
+class MultiplexTests(ChatSocketTestCase):
+    """Several rooms over one MultiplexConsumer connection (ws/mux/)."""
+
+    def setUp(self):
+        super().setUp()
+        self.other_room = Room.objects.create(name="other", is_group=True, admin=self.alice)
+        self.other_room.participants.add(self.alice)
+
+    async def connect_mux(self, profile):
+        from chat_backend.asgi import application
+
+        communicator = WebsocketCommunicator(
+            application, f"/ws/mux/?token={AccessToken.for_user(profile.user)}"
+        )
+        await communicator.connect()
+        self.assertEqual(await self.receive(communicator), {"type": "connected"})
+        return communicator
+
+    async def subscribe(self, communicator, room):
+        await communicator.send_json_to(
+            {"type": "subscribe", "stream": "room", "room_id": room.id, "last_id": 0}
+        )
+        self.assertEqual(
+            await self.receive(communicator),
+            {"type": "subscribed", "stream": "room", "room_id": room.id},
+        )
+        frames, done = await self.receive_replay(communicator)
+        self.assertEqual(done["room_id"], room.id)
+        return frames
+
+    async def test_room_id_on_every_frame(self):
+        alice = await self.connect_mux(self.alice)
+        await self.subscribe(alice, self.room)
+        await self.subscribe(alice, self.other_room)
+
+        for room in (self.room, self.other_room):
+            await alice.send_json_to({"room_id": room.id, "encrypted_text": room.name})
+            frame = await self.receive(alice)
+            self.assertEqual(
+                (frame["type"], frame["room_id"], frame["encrypted_text"]),
+                ("chat_message", room.id, room.name),
+            )
+
+        # Replays are tagged too
+        again = await self.connect_mux(self.alice)
+        frames = await self.subscribe(again, self.other_room)
+        self.assertEqual([frame["room_id"] for frame in frames], [self.other_room.id])
+
+        await alice.disconnect()
+        await again.disconnect()
+
+    async def test_unsubscribe(self):
+        alice = await self.connect_mux(self.alice)
+        await self.subscribe(alice, self.room)
+
+        await alice.send_json_to({"type": "unsubscribe", "stream": "room", "room_id": self.room.id})
+        await alice.send_json_to({"room_id": self.room.id, "encrypted_text": "hi"})
+
+        self.assertEqual(await self.receive(alice), {
+            "type": "error",
+            "reason": "not_subscribed",
+            "stream": None,
+            "room_id": self.room.id,
+        })
+        self.assertFalse(await Message.objects.aexists())
+        await alice.disconnect()
+
+    async def test_subscribe_forbidden(self):
+        bob = await self.connect_mux(self.bob)
+        await bob.send_json_to({"type": "subscribe", "stream": "room", "room_id": self.other_room.id})
+
+        self.assertEqual(await self.receive(bob), {
+            "type": "error",
+            "reason": "forbidden",
+            "stream": "room",
+            "room_id": self.other_room.id,
+        })
+        await bob.disconnect()
+
+    async def test_removed_from_subscribed_room(self):
+        bob = await self.connect_mux(self.bob)
+        await self.subscribe(bob, self.room)
+
+        await self.change_members("remove_member", self.bob)
+        self.assertEqual(await self.receive(bob), {"type": "removed", "room_id": self.room.id})
+
+        alice = await self.connect_mux(self.alice)
+        await self.subscribe(alice, self.room)
+        await alice.send_json_to({"room_id": self.room.id, "encrypted_text": "hi"})
+        await self.receive(alice)
+        self.assertTrue(await bob.receive_nothing())
+
+        await alice.disconnect()
+        await bob.disconnect()
+
+
+class PresenceTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.profile = make_profile("owner")
+        self.contact = make_profile("contact")
+        self.member = make_profile("member")
+        self.stranger = make_profile("stranger")
+
+        Contact.objects.create(owner=self.profile, contact=self.contact)
+        room = Room.objects.create(name="room", is_group=True, admin=self.profile)
+        room.participants.add(self.profile, self.member)
+
+    def test_only_contacts_and_room_members_visible(self):
+        client = APIClient()
+        client.force_authenticate(self.profile.user)
+        ids = [self.profile.id, self.contact.id, self.member.id, self.stranger.id]
+
+        response = client.get(
+            "/api/userprofile/presence/",
+            {"profile_ids": ",".join(map(str, ids))},
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            sorted(state["profile_id"] for state in response.data),
+            sorted([self.profile.id, self.contact.id, self.member.id]),
+        )
+
+    def test_expired_entry_keeps_all_connections(self):
+        profile_id = self.contact.id
+        async_to_sync(presence.connect)(profile_id)
+        async_to_sync(presence.connect)(profile_id)
+
+        # Missed heartbeats: the entry expires while both sockets are open
+        cache.delete(presence.online_key(profile_id))
+        self.assertTrue(async_to_sync(presence.heartbeat)(profile_id))
+        self.assertFalse(async_to_sync(presence.heartbeat)(profile_id))
+
+        self.assertIsNone(async_to_sync(presence.disconnect)(profile_id))
+        self.assertTrue(presence.get_presence([profile_id])[profile_id]["online"])
+        self.assertIsNotNone(async_to_sync(presence.disconnect)(profile_id))
+
+
+class RoomMembershipEndpointTests(TestCase):
+    """participants_ids handling on room create / add_member / remove_member."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = make_profile("admin")
+        cls.members = [make_profile(f"member{i}") for i in range(30)]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin.user)
+        self.room_numbers = itertools.count()
+
+    def post(self, url, participants_ids, status=200, **data):
+        response = self.client.post(
+            url, {"participants_ids": participants_ids, **data}, format="json"
+        )
+        self.assertEqual(response.status_code, status)
+        return response.data
+
+    def create_room(self, participants_ids=()):
+        data = self.post(
+            "/api/rooms/", list(participants_ids),
+            status=201, name=f"room{next(self.room_numbers)}", is_group=True,
+        )
+        return Room.objects.get(id=data["id"])
+
+    def test_resolve_profiles_reports_invalid_ids_in_request_order(self):
+        valid = self.members[0].id
+        unknown = max(member.id for member in self.members) + 100
+        found, invalid = resolve_profiles(["x", unknown, str(valid), None, unknown])
+
+        self.assertEqual(found, {valid: self.members[0].user_id})
+        self.assertEqual(invalid, ["x", None, unknown])
+
+    def test_create_reports_invalid_ids(self):
+        unknown = max(member.id for member in self.members) + 100
+        data = self.post(
+            "/api/rooms/", [self.members[0].id, unknown, "abc"],
+            status=201, name="room", is_group=True,
+        )
+        self.assertEqual(data["invalid_ids"], ["abc", unknown])
+
+    def test_create_adds_admin_once(self):
+        room = self.create_room([self.admin.id, self.members[0].id])
+        self.assertEqual(
+            sorted(room.participants.values_list("id", flat=True)),
+            sorted([self.admin.id, self.members[0].id]),
+        )
+
+    def test_add_and_remove_member(self):
+        room = self.create_room()
+        url = f"/api/rooms/{room.id}/"
+
+        data = self.post(url + "add_member/", [self.members[0].id, "abc"])
+        self.assertEqual(data["invalid_ids"], ["abc"])
+        self.assertTrue(room.participants.filter(id=self.members[0].id).exists())
+
+        data = self.post(url + "remove_member/", [self.members[0].id])
+        self.assertEqual(data["invalid_ids"], [])
+        self.assertFalse(room.participants.filter(id=self.members[0].id).exists())
+
+    def count_queries(self, func):
+        with CaptureQueriesContext(connection) as queries:
+            func()
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_ids(self):
+        few = [member.id for member in self.members[:2]]
+        many = [member.id for member in self.members[2:]]
+
+        self.assertEqual(
+            self.count_queries(lambda: self.create_room(few)),
+            self.count_queries(lambda: self.create_room(many)),
+        )
+
+        rooms = [self.create_room(), self.create_room()]
+        for action in ("add_member", "remove_member"):
+            self.assertEqual(
+                self.count_queries(
+                    lambda: self.post(f"/api/rooms/{rooms[0].id}/{action}/", few)
+                ),
+                self.count_queries(
+                    lambda: self.post(f"/api/rooms/{rooms[1].id}/{action}/", many)
+                ),
+            )
+
+
+class MessagePaginationTests(TestCase):
+    """MessageKeysetPagination on /api/messages/ (opt-in keyset paging)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.profile = make_profile("owner")
+        cls.room = Room.objects.create(name="room", is_group=True, admin=cls.profile)
+        cls.room.participants.add(cls.profile)
+        cls.ids = [
+            Message.objects.create(
+                room=cls.room, user=cls.profile, encrypted_text=f"m{i}", key_version=1
+            ).id
+            for i in range(5)
+        ]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.profile.user)
+
+    def get(self, url=None, **params):
+        if url is None:
+            response = self.client.get("/api/messages/", {"room_id": self.room.id, **params})
+        else:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def result_ids(self, data):
+        return [message["id"] for message in data["results"]]
+
+    def test_plain_list_without_page_params(self):
+        data = self.get()
+        self.assertEqual([message["id"] for message in data], self.ids)
+
+    def test_before_and_after_cursors(self):
+        latest = self.get(limit=2)
+        self.assertEqual(self.result_ids(latest), self.ids[3:])
+        self.assertIsNone(latest["next"])
+
+        older = self.get(latest["previous"])
+        self.assertEqual(self.result_ids(older), self.ids[1:3])
+
+        oldest = self.get(older["previous"])
+        self.assertEqual(self.result_ids(oldest), self.ids[:1])
+        self.assertIsNone(oldest["previous"])
+
+        newer = self.get(oldest["next"])
+        self.assertEqual(self.result_ids(newer), self.ids[1:3])
+
+    def test_since_id(self):
+        first = self.get(since_id=self.ids[0], limit=3)
+        self.assertEqual(self.result_ids(first), self.ids[1:4])
+
+        rest = self.get(first["next"])
+        self.assertEqual(self.result_ids(rest), self.ids[4:])
+        self.assertIsNone(rest["next"])
+
+    def test_page_query_count(self):
+        # profile, messages (+ room, user, auth user)
+        with self.assertNumQueries(2):
+            self.get(limit=2)
+
+
+class ArchivedHistoryTests(TestCase):
+    """archive_messages and paging through hot + archived messages."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.profile = make_profile("owner")
+        cls.room = Room.objects.create(name="room", is_group=True, admin=cls.profile)
+        cls.room.participants.add(cls.profile)
+        cls.ids = create_messages(cls.room, cls.profile, 8)
+        # The newest two stay recent, so the hot tier keeps m6 and m7
+        archive_messages(cls.ids[:6])
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.profile.user)
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_last_message_stays_hot(self):
+        room = Room.objects.create(name="quiet", is_group=True, admin=self.profile)
+        ids = create_messages(room, self.profile, 3)
+        archive_messages(ids)
+
+        self.assertEqual(
+            list(Message.objects.filter(room=room).values_list("id", flat=True)),
+            ids[2:],
+        )
+        self.assertEqual(
+            list(ArchivedMessage.objects.filter(room=room).values_list("id", flat=True)),
+            ids[:2],
+        )
+
+    def test_page_back_across_tables(self):
+        self.assertEqual(
+            sorted(ArchivedMessage.objects.values_list("id", flat=True)), self.ids[:6]
+        )
+
+        url = f"/api/messages/?room_id={self.room.id}&limit=3"
+        pages = []
+        while url:
+            data = self.get(url)
+            pages.insert(0, [message["id"] for message in data["results"]])
+            url = data["previous"]
+
+        self.assertEqual(pages, [self.ids[:2], self.ids[2:5], self.ids[5:]])
+        self.assertEqual(
+            [message["encrypted_text"] for message in data["results"]], ["m0", "m1"]
+        )
+
+    def test_since_id_across_tables(self):
+        url = f"/api/messages/?room_id={self.room.id}&limit=3&since_id={self.ids[0]}"
+        pages = []
+        while url:
+            data = self.get(url)
+            pages.append([message["id"] for message in data["results"]])
+            url = data["next"]
+
+        self.assertEqual(pages, [self.ids[1:4], self.ids[4:7], self.ids[7:]])
+
+
+class RoomKeyETagTests(TestCase):
+    """Conditional GET on /api/room-keys/ (ETag from Room.key_version)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = make_profile("alice")
+        cls.bob = make_profile("bob")
+        cls.room = Room.objects.create(name="room", is_group=True, admin=cls.alice)
+        cls.room.participants.add(cls.alice, cls.bob)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.bob.user)
+        self.url = f"/api/room-keys/?room_id={self.room.id}"
+
+    def rotate_keys(self):
+        client = APIClient()
+        client.force_authenticate(self.alice.user)
+        response = client.post(
+            f"/api/rooms/{self.room.id}/set-room-keys/",
+            {"keys": [{"user_profile_id": self.bob.id, "encrypted_room_key": "k"}]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_not_modified_until_rotation(self):
+        self.rotate_keys()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 1)
+        etag = response["ETag"]
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+        self.rotate_keys()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.room.refresh_from_db()
+        self.assertEqual(
+            [key["version"] for key in response.data],
+            [self.room.key_version, self.room.key_version - 1],
+        )
+        self.assertNotEqual(response["ETag"], etag)
+
+
+class PublicKeyCacheTests(TestCase):
+    """Bulk ?user_ids= public key lookup and its cache invalidation."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = make_profile("alice")
+        cls.bob = make_profile("bob")
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice.user)
+
+    def public_keys(self):
+        response = self.client.get(f"/api/encryption-keys/?user_ids={self.bob.user_id}")
+        self.assertEqual(response.status_code, 200)
+        return [row["public_key"] for row in response.data]
+
+    def test_key_update_invalidates_after_commit(self):
+        key = UserEncryptionKey.objects.create(user=self.bob.user, public_key="old")
+        self.assertEqual(self.public_keys(), ["old"])
+
+        bob = APIClient()
+        bob.force_authenticate(self.bob.user)
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = bob.patch(
+                f"/api/encryption-keys/{key.id}/", {"public_key": "new"}, format="json"
+            )
+            self.assertEqual(response.status_code, 200)
+
+        # Still cached until the transaction commits
+        self.assertEqual(self.public_keys(), ["old"])
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.public_keys(), ["new"])
+
+    def test_new_key_replaces_cached_absence(self):
+        self.assertEqual(self.public_keys(), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            UserEncryptionKey.objects.create(user=self.bob.user, public_key="first")
+
+        self.assertEqual(self.public_keys(), ["first"])
+
+
+class FakeRedisChannelLayer(RedisChannelLayer):
+    """channels_redis layer whose shards are in-process fakeredis servers."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.servers = [fakeredis.FakeServer() for _ in self.hosts]
+
+    def create_pool(self, index):
+        return aioredis.ConnectionPool(
+            connection_class=fakeredis.aioredis.FakeConnection,
+            server=self.servers[index],
+        )
+
+
+class PipelinedGroupSendTests(SimpleTestCase):
+    """
+    send_batch reimplements channels_redis group_send on top of its
+    internals; run it against (fake) Redis so an upgrade can't break it
+    silently.
+    """
+
+    async def receive(self, layer, channel):
+        return await asyncio.wait_for(layer.receive(channel), timeout=1)
+
+    async def test_delivers_to_every_group_across_shards(self):
+        layer = FakeRedisChannelLayer(hosts=["redis://shard0", "redis://shard1"])
+        self.assertTrue(notifications._supports_pipelining(layer))
+
+        groups = [
+            fanout.notification_group("groups", profile_id)
+            for profile_id in (1, 2, 3, 8, 9, 10)
+        ]
+        self.assertEqual({layer.consistent_hash(group) for group in groups}, {0, 1})
+
+        members = {}
+        for i, group in enumerate(groups):
+            members[group] = [await layer.new_channel() for _ in range(2)]
+            for channel in members[group]:
+                await layer.group_add(group, channel)
+        # One channel in two groups receives both events
+        shared = members[groups[0]][0]
+        await layer.group_add(groups[1], shared)
+
+        await notifications.send_batch(
+            layer, [(group, {"type": "notify", "group": group}) for group in groups]
+        )
+
+        for group in groups:
+            for channel in members[group]:
+                if channel == shared:
+                    continue
+                self.assertEqual(
+                    await self.receive(layer, channel), {"type": "notify", "group": group}
+                )
+
+        received = {(await self.receive(layer, shared))["group"] for _ in range(2)}
+        self.assertEqual(received, {groups[0], groups[1]})
+
+        await layer.flush()
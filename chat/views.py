@@ -1,5 +1,10 @@
+import itertools
+
+from django.conf import settings
 from django.shortcuts import get_object_or_404
-from django.db import models
+from django.utils import timezone
+from django.db import models, transaction
+from django.db.models.functions import Coalesce
 from django.contrib.auth import get_user_model
 
 from rest_framework import viewsets, permissions, status, serializers
@@ -9,24 +14,97 @@ from rest_framework.response import Response
 from asgiref.sync import async_to_sync
 from channels.layers import get_channel_layer
 
+from . import archive, fanout
+from .activity import record_last_messages
+from .conditional import make_etag, not_modified, set_validators
+from .notifications import NotificationBatch
+from .presence import get_presence, visible_profiles
+from .public_keys import get_public_keys
+from .pagination import (
+    ContactSyncPagination,
+    MessageKeysetPagination,
+    RoomKeyPagination,
+)
 from .models import (
     UserProfile,
+    Contact,
     Room,
     Message,
+    ArchivedMessage,
     UserEncryptionKey,
     RoomKeyForUser,
+    RoomReadCursor,
 )
 from .serializers import (
     RegisterSerializer,
     RoomSerializer,
     MessageSerializer,
+    InboxRoomSerializer,
     UserProfileSerializer,
+    ContactSerializer,
     UserEncryptionKeySerializer,
+    PublicKeySerializer,
     RoomKeyForUserSerializer,
 )
 
 User = get_user_model()
 
+
+def profiles_with_user(lookup):
+    """
+    Prefetch for a UserProfile relation rendered by UserProfileMiniSerializer
+    (which nests the User), so lists don't issue one query per profile.
+    """
+    return models.Prefetch(
+        lookup, queryset=UserProfile.objects.select_related("user")
+    )
+
+
+def resolve_profiles(raw_ids):
+    """
+    Resolve participant ids in one query. Returns ({profile_id: user_id},
+    invalid_ids), where invalid_ids are the values that are not ints or
+    do not match a profile, in request order.
+    """
+    ids, invalid = [], []
+    for value in raw_ids:
+        try:
+            ids.append(int(value))
+        except (TypeError, ValueError):
+            invalid.append(value)
+
+    found = dict(
+        UserProfile.objects.filter(id__in=ids).values_list("id", "user_id")
+    )
+    invalid += [pid for pid in dict.fromkeys(ids) if pid not in found]
+    return found, invalid
+
+
+def notify_room_members_changed(batch, room, added=(), removed=()):
+    """
+    Queue a membership delta for every ChatConsumer connected to the room
+    (plus the removed users) so their cached participant sets stay valid.
+    Added users also get it on their own user group: a socket that was
+    removed earlier has left the room group and must rejoin it.
+    """
+    if not added and not removed:
+        return
+
+    event = {
+        "type": "room_members_changed",
+        "room_id": room.id,
+        "added": list(added),
+        "removed": list(removed),
+    }
+
+    user_ids = itertools.chain(
+        room.participants.values_list("user_id", flat=True),
+        removed,
+    )
+    groups = fanout.member_groups(room.id, user_ids)
+    groups += [fanout.user_group(room.id, user_id) for user_id in added]
+    batch.add_many(list(dict.fromkeys(groups)), event)
+
 # ---------------------------
 # UserProfileViewSet
 # ---------------------------
@@ -36,7 +114,63 @@ class UserProfileViewSet(viewsets.ModelViewSet):
     queryset = UserProfile.objects.all()
 
     def get_queryset(self):
-        return UserProfile.objects.filter(user=self.request.user)
+        # contacts are loaded by UserProfile.active_contacts (one query)
+        return (
+            UserProfile.objects
+            .filter(user=self.request.user)
+            .select_related("user")
+        )
+
+    @action(detail=False, methods=["get"])
+    def contacts(self, request):
+        """
+        Paginated contact list with delta sync, see ContactSyncPagination.
+        Without ?changed_since= only current contacts are returned.
+        """
+        queryset = (
+            Contact.objects
+            .filter(owner__user=request.user)
+            .select_related("contact__user")
+        )
+        if "changed_since" not in request.query_params:
+            queryset = queryset.filter(removed_at__isnull=True)
+
+        paginator = ContactSyncPagination()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        serializer = ContactSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=["get"])
+    def presence(self, request):
+        """
+        ?profile_ids=1,2,3 -> online state and last_seen of those profiles,
+        served from the presence cache. Only the caller's active contacts
+        and room co-members are visible; other ids are left out.
+        """
+        raw_ids = request.query_params.get("profile_ids", "")
+        try:
+            profile_ids = sorted({int(value) for value in raw_ids.split(",") if value})
+        except ValueError:
+            profile_ids = None
+        if not profile_ids:
+            return Response(
+                {"detail": "profile_ids must be a comma separated list of ids."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        limit = getattr(settings, "CHAT_PRESENCE_BULK_LIMIT", 500)
+        if len(profile_ids) > limit:
+            return Response(
+                {"detail": f"At most {limit} profile_ids per request."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        profile = UserProfile.objects.get(user=request.user)
+        visible = visible_profiles(profile.id, profile_ids)
+        profile_ids = [profile_id for profile_id in profile_ids if profile_id in visible]
+
+        states = get_presence(profile_ids)
+        return Response([states[profile_id] for profile_id in profile_ids])
 
     @action(detail=False, methods=["post"])
     def add_contact(self, request):
@@ -46,22 +180,34 @@ class UserProfileViewSet(viewsets.ModelViewSet):
         if not profile_id:
             return Response({"error": "profile_id is required"}, status=400)
 
-        new_contact = get_object_or_404(UserProfile, id=profile_id)
+        new_contact = get_object_or_404(
+            UserProfile.objects.select_related("user"), id=profile_id
+        )
 
         if new_contact == profile:
             return Response({"error": "You cannot add yourself."}, status=400)
 
-        if profile.contacts.filter(id=new_contact.id).exists():
+        if Contact.objects.filter(
+            owner=profile, contact=new_contact, removed_at__isnull=True
+        ).exists():
             return Response({"message": "Already in contacts."}, status=200)
 
-        profile.contacts.add(new_contact)
-        profile.save()
-        new_contact.contacts.add(profile)
-        new_contact.save()
+        # Both directions in one statement; revives tombstones in place
+        with transaction.atomic():
+            Contact.objects.bulk_create(
+                [
+                    Contact(owner=profile, contact=new_contact),
+                    Contact(owner=new_contact, contact=profile),
+                ],
+                update_conflicts=True,
+                unique_fields=["owner", "contact"],
+                update_fields=["updated_at", "removed_at"],
+            )
+
         channel_layer = get_channel_layer()
         async_to_sync(channel_layer.group_send)(
-            f"contact_list_{profile_id}",
-            {"type": "notify"}
+            fanout.notification_group("contacts", profile_id),
+            fanout.notify_event("contacts", added=[profile.id])
         )
         # async_to_sync(channel_layer.group_send)(
         #     f"contact_list_{profile_id}",
@@ -77,19 +223,30 @@ class UserProfileViewSet(viewsets.ModelViewSet):
         if not profile_id:
             return Response({"error": "profile_id required"}, status=400)
 
-        contact = get_object_or_404(UserProfile, id=profile_id)
+        contact = get_object_or_404(
+            UserProfile.objects.select_related("user"), id=profile_id
+        )
 
-        if not profile.contacts.filter(id=contact.id).exists():
+        # Tombstone both directions in one statement
+        now = timezone.now()
+        with transaction.atomic():
+            removed = (
+                Contact.objects
+                .filter(
+                    models.Q(owner=profile, contact=contact)
+                    | models.Q(owner=contact, contact=profile),
+                    removed_at__isnull=True,
+                )
+                .update(removed_at=now, updated_at=now)
+            )
+
+        if not removed:
             return Response({"error": "Not found in contacts."}, status=404)
 
-        profile.contacts.remove(contact)
-        profile.save()
-        contact.contacts.remove(profile)
-        contact.save()
         channel_layer = get_channel_layer()
         async_to_sync(channel_layer.group_send)(
-            f"contact_list_{profile_id}",
-            {"type": "notify"}
+            fanout.notification_group("contacts", profile_id),
+            fanout.notify_event("contacts", removed=[profile.id])
         )
         # async_to_sync(channel_layer.group_send)(
         #     f"contact_list_{profile_id}",
@@ -122,9 +279,14 @@ class RoomViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         profile = UserProfile.objects.get(user=self.request.user)
-        return Room.objects.filter(
-            models.Q(participants=profile) | models.Q(admin=profile)
-        ).distinct()
+        return (
+            Room.objects.filter(
+                models.Q(participants=profile) | models.Q(admin=profile)
+            )
+            .distinct()
+            .select_related("admin__user")
+            .prefetch_related(profiles_with_user("participants"))
+        )
         
         # rooms_as_participant = Room.objects.filter(participants=profile)
         # rooms_as_admin = Room.objects.filter(admin=profile)
@@ -144,18 +306,27 @@ class RoomViewSet(viewsets.ModelViewSet):
         if not name:
             return Response({"error": "Room name required"}, status=400)
 
-        room = Room.objects.create(name=name, is_group=is_group, admin=admin_profile)
+        participants, invalid_ids = resolve_profiles(participant_ids)
 
-        for pid in participant_ids:
-            try:
-                participant = UserProfile.objects.get(id=pid)
-                room.participants.add(participant)
-            except UserProfile.DoesNotExist:
-                continue
+        batch = NotificationBatch()
+        with transaction.atomic():
+            room = Room.objects.create(name=name, is_group=is_group, admin=admin_profile)
+            room.participants.add(admin_profile.id, *participants)
+
+            batch.add_many(
+                [
+                    fanout.notification_group("groups", pid)
+                    for pid in participants
+                    if pid != admin_profile.id
+                ],
+                fanout.notify_event("groups", added=[room.id]),
+            )
+            batch.flush_on_commit()
 
-        room.participants.add(admin_profile)
+        # Participants (+ user) in one query; add/remove drop any prefetch
+        models.prefetch_related_objects([room], profiles_with_user("participants"))
         serializer = self.get_serializer(room)
-        return Response(serializer.data, status=201)
+        return Response({**serializer.data, "invalid_ids": invalid_ids}, status=201)
 
     @action(detail=True, methods=["post"])
     def add_member(self, request, pk=None):
@@ -167,21 +338,25 @@ class RoomViewSet(viewsets.ModelViewSet):
                 {"detail": "Only room admin can add members."},
                 status=status.HTTP_403_FORBIDDEN,
             )
-            
-        channel_layer = get_channel_layer()
+
+        batch = NotificationBatch()
 
         participant_ids = request.data.get("participants_ids", [])
-        for pid in participant_ids:
-            try:
-                participant = UserProfile.objects.get(id=pid)
-                room.participants.add(participant)
-                async_to_sync(channel_layer.group_send)(
-                    f"group_list_{pid}",
-                    {"type": "notify"}
-                )
+        participants, invalid_ids = resolve_profiles(participant_ids)
+        with transaction.atomic():
+            if participants:
+                room.participants.add(*participants)
+
+            batch.add_many(
+                [fanout.notification_group("groups", pid) for pid in participants],
+                fanout.notify_event("groups", added=[room.id]),
+            )
 
-            except UserProfile.DoesNotExist:
-                continue
+            # Keep the open ChatConsumer room caches in sync
+            notify_room_members_changed(
+                batch, room, added=list(participants.values())
+            )
+            batch.flush_on_commit()
 
         # 🔐 AUTO KEY ROTATION
 
@@ -190,27 +365,35 @@ class RoomViewSet(viewsets.ModelViewSet):
         #     {"type": "room.key_rotated", "version": room.key_version},
         # )
 
+        # Participants (+ user) in one query; add/remove drop any prefetch
+        models.prefetch_related_objects([room], profiles_with_user("participants"))
         serializer = self.get_serializer(room)
-        return Response(serializer.data, status=200)
+        return Response({**serializer.data, "invalid_ids": invalid_ids}, status=200)
 
     @action(detail=True, methods=["post"])
     def remove_member(self, request, pk=None):
         room = self.get_object()
         profile = UserProfile.objects.get(user=request.user)
-        
-        channel_layer = get_channel_layer()
-        
+
+        batch = NotificationBatch()
+
         participant_ids = request.data.get("participants_ids", [])
-        for pid in participant_ids:
-            try:
-                participant = UserProfile.objects.get(id=pid)
-                room.participants.remove(participant)
-                async_to_sync(channel_layer.group_send)(
-                    f"group_list_{pid}",
-                    {"type": "notify"}
-                )
-            except UserProfile.DoesNotExist:
-                continue
+        participants, invalid_ids = resolve_profiles(participant_ids)
+        with transaction.atomic():
+            if participants:
+                room.participants.remove(*participants)
+
+            batch.add_many(
+                [fanout.notification_group("groups", pid) for pid in participants],
+                fanout.notify_event("groups", removed=[room.id]),
+            )
+
+            # Keep the open ChatConsumer room caches in sync; removed users
+            # are notified too so their connections stop accepting messages.
+            notify_room_members_changed(
+                batch, room, removed=list(participants.values())
+            )
+            batch.flush_on_commit()
         
         # async_to_sync(channel_layer.group_send)(
         #     f"chat_{room.id}_user_{room.admin.id}",
@@ -227,65 +410,144 @@ class RoomViewSet(viewsets.ModelViewSet):
         #     {"type": "room.key_rotated", "version": room.key_version},
         # )
 
+        # Participants (+ user) in one query; add/remove drop any prefetch
+        models.prefetch_related_objects([room], profiles_with_user("participants"))
         serializer = self.get_serializer(room)
-        return Response(serializer.data, status=200)
+        return Response({**serializer.data, "invalid_ids": invalid_ids}, status=200)
+
+    @action(detail=False, methods=["get"])
+    def inbox(self, request):
+        """
+        Sidebar: every room the user is in with its latest message, the
+        read cursor and the unread count, most recently active first.
+        Two queries regardless of the number of rooms.
+        """
+        profile = UserProfile.objects.get(user=request.user)
 
-    @action(detail=True, methods=["post"], url_path="set-room-keys")
-    def set_room_keys(self, request, pk=None):
-        room = Room.objects.get(pk=pk)
+        read_cursor = (
+            RoomReadCursor.objects
+            .filter(room=models.OuterRef("pk"), user=profile)
+            .values("last_read_message_id")[:1]
+        )
+        unread = (
+            Message.objects
+            .filter(
+                room=models.OuterRef("pk"),
+                id__gt=Coalesce(models.OuterRef("last_read_id"), 0),
+            )
+            .exclude(user=profile)
+            .order_by()
+            .values("room")
+            .annotate(count=models.Count("id"))
+            .values("count")
+        )
 
-        keys_data = request.data.get("keys", [])
-        if not isinstance(keys_data, list) or not keys_data:
-            return Response(
-                {"detail": "keys list required."},
-                status=status.HTTP_400_BAD_REQUEST,
+        # last_message / last_activity_at are denormalized on Room
+        rooms = (
+            Room.objects
+            .filter(participants=profile)
+            .select_related("last_message__user__user")
+            .annotate(last_read_id=Coalesce(models.Subquery(read_cursor), 0))
+            .annotate(unread_count=Coalesce(models.Subquery(unread), 0))
+            .order_by(
+                models.F("last_activity_at").desc(nulls_last=True),
+                "-created_at",
             )
+        )
 
-        # 1️⃣ Rotate version
-        room.key_version += 1
-        room.save(update_fields=["key_version"])
-        version = room.key_version
+        return Response(InboxRoomSerializer(rooms, many=True).data)
 
-        created = []
-        for item in keys_data:
-            uid = item.get("user_profile_id")
-            enc = item.get("encrypted_room_key")
-            if not uid or not enc:
-                continue
+    @action(detail=True, methods=["post"])
+    def read(self, request, pk=None):
+        """Advance the read cursor to message_id (never moves backwards)."""
+        profile = UserProfile.objects.get(user=request.user)
+        room = get_object_or_404(Room.objects.filter(participants=profile), pk=pk)
 
-            try:
-                target_profile = UserProfile.objects.get(id=uid)
-            except UserProfile.DoesNotExist:
-                continue
+        try:
+            message_id = int(request.data.get("message_id"))
+        except (TypeError, ValueError):
+            return Response({"error": "message_id is required"}, status=400)
 
-            if target_profile not in room.participants.all():
-                continue
+        updated = RoomReadCursor.objects.filter(
+            room=room, user=profile, last_read_message_id__lt=message_id
+        ).update(last_read_message_id=message_id, updated_at=timezone.now())
 
-            obj, _ = RoomKeyForUser.objects.update_or_create(
+        if not updated:
+            cursor, _ = RoomReadCursor.objects.get_or_create(
                 room=room,
-                user=target_profile,
-                version=version,
-                defaults={"encrypted_room_key": enc},
+                user=profile,
+                defaults={"last_read_message_id": message_id},
             )
-            created.append(obj.id)
+            message_id = max(message_id, cursor.last_read_message_id)
 
-        # 2️⃣ Notify EACH USER WS GROUP
-        channel_layer = get_channel_layer()
+        return Response({"status": "ok", "last_read_id": message_id}, status=200)
 
-        participant_user_ids = (
-            room.participants
-            .select_related("user")
-            .values_list("user_id", flat=True)
-        )
+    @action(detail=True, methods=["post"], url_path="set-room-keys")
+    def set_room_keys(self, request, pk=None):
+        keys_data = request.data.get("keys", [])
+        if not isinstance(keys_data, list) or not keys_data:
+            return Response(
+                {"detail": "keys list required."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        batch = NotificationBatch()
+
+        with transaction.atomic():
+            # 1️⃣ Rotate version
+            room = get_object_or_404(Room.objects.select_for_update(), pk=pk)
+            room.key_version += 1
+            room.save(update_fields=["key_version"])
+            version = room.key_version
+
+            # profile id -> user id for every participant, in one query
+            participants = dict(room.participants.values_list("id", "user_id"))
+
+            # Validate every entry against the participant set; the last
+            # key wins if a profile is listed twice.
+            wrapped_keys = {}
+            for item in keys_data:
+                uid = item.get("user_profile_id")
+                enc = item.get("encrypted_room_key")
+                if not uid or not enc:
+                    continue
+
+                try:
+                    uid = int(uid)
+                except (TypeError, ValueError):
+                    continue
+
+                if uid not in participants:
+                    continue
+
+                wrapped_keys[uid] = enc
+
+            objs = RoomKeyForUser.objects.bulk_create(
+                [
+                    RoomKeyForUser(
+                        room=room,
+                        user_id=uid,
+                        version=version,
+                        encrypted_room_key=enc,
+                    )
+                    for uid, enc in wrapped_keys.items()
+                ],
+                update_conflicts=True,
+                unique_fields=["room", "user", "version"],
+                update_fields=["encrypted_room_key"],
+            )
+            created = [obj.id for obj in objs]
 
-        for user_id in participant_user_ids:
-            async_to_sync(channel_layer.group_send)(
-                f"chat_{room.id}_user_{user_id}",
+            # 2️⃣ Notify every member WS connection once the keys are committed
+            batch.add_many(
+                fanout.member_groups(room.id, participants.values()),
                 {
                     "type": "room_key_rotated",
+                    "room_id": room.id,
                     "version": version,
                 },
             )
+            batch.flush_on_commit()
 
         return Response(
             {"status": "ok", "created_ids": created},
@@ -318,6 +580,7 @@ class RoomViewSet(viewsets.ModelViewSet):
 class MessageViewSet(viewsets.ModelViewSet):
     serializer_class = MessageSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = MessageKeysetPagination
 
     def get_queryset(self):
         profile = UserProfile.objects.get(user=self.request.user)
@@ -328,7 +591,29 @@ class MessageViewSet(viewsets.ModelViewSet):
         if room_id:
             qs = qs.filter(room_id=room_id)
 
-        return qs.select_related("room", "user")
+        # MessageSerializer.get_user reads user.user.username
+        return qs.select_related("room", "user__user")
+
+    def get_archive_queryset(self):
+        """
+        Cold tier for MessageKeysetPagination: messages moved out by the
+        archive_messages command, under the same room filters.
+        """
+        if self.action != "list":
+            return ArchivedMessage.objects.none()
+
+        profile = UserProfile.objects.get(user=self.request.user)
+        room_id = self.request.query_params.get("room_id")
+
+        qs = ArchivedMessage.objects.filter(room__participants=profile)
+
+        if room_id:
+            qs = qs.filter(room_id=room_id)
+
+        return qs.select_related("room", "user__user")
+
+    def unpack_archived(self, archived):
+        return archive.unpack(archived)
 
     def perform_create(self, serializer):
         profile = UserProfile.objects.get(user=self.request.user)
@@ -350,7 +635,8 @@ class MessageViewSet(viewsets.ModelViewSet):
             if key_version != room.key_version:
                 raise serializers.ValidationError("Stale room key version")
 
-            serializer.save(
+            self.save_message(
+                serializer,
                 user=profile,
                 room=room,
                 encrypted_for_sender=None,
@@ -371,13 +657,20 @@ class MessageViewSet(viewsets.ModelViewSet):
                 "Both encrypted_for_sender and encrypted_for_receiver are required"
             )
 
-        serializer.save(
+        self.save_message(
+            serializer,
             user=profile,
             room=room,
             encrypted_text=None,
             key_version=None,
         )
 
+    def save_message(self, serializer, **fields):
+        # Insert and move Room.last_message in one transaction
+        with transaction.atomic():
+            message = serializer.save(**fields)
+            record_last_messages([message])
+
 # ---------------------------
 # UserEncryptionKey viewset
 # ---------------------------
@@ -387,6 +680,10 @@ class UserEncryptionKeyViewSet(viewsets.ModelViewSet):
     queryset = UserEncryptionKey.objects.all()
 
     def list(self, request, *args, **kwargs):
+        user_ids = request.query_params.get("user_ids")
+        if user_ids is not None:
+            return self.bulk_public_keys(request, user_ids)
+
         user_id = request.query_params.get("user_id")
         if user_id:
             qs = self.get_queryset().filter(user_id=user_id)
@@ -394,6 +691,38 @@ class UserEncryptionKeyViewSet(viewsets.ModelViewSet):
             qs = self.get_queryset().filter(user=request.user)
         serializer = self.get_serializer(qs, many=True)
         return Response(serializer.data)
+
+    def bulk_public_keys(self, request, raw_ids):
+        """
+        ?user_ids=1,2,3 -> public keys of all those users in one request.
+        Users without a key are simply absent from the result.
+        """
+        try:
+            user_ids = sorted({int(value) for value in raw_ids.split(",") if value})
+        except ValueError:
+            return Response(
+                {"detail": "user_ids must be a comma separated list of ids."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        limit = getattr(settings, "CHAT_PUBLIC_KEY_BULK_LIMIT", 500)
+        if len(user_ids) > limit:
+            return Response(
+                {"detail": f"At most {limit} user_ids per request."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        keys = get_public_keys(user_ids)
+        rows = [keys[user_id] for user_id in user_ids if user_id in keys]
+
+        etag = make_etag([(row["user"], row["updated_at"]) for row in rows])
+        last_modified = max((row["updated_at"] for row in rows), default=None)
+
+        response = not_modified(request, etag, last_modified)
+        if response is None:
+            serializer = PublicKeySerializer(rows, many=True)
+            response = Response(serializer.data)
+        return set_validators(response, etag, last_modified)
     
     def perform_create(self, serializer):
         # 🔐 FORCE ownership
@@ -403,22 +732,90 @@ class UserEncryptionKeyViewSet(viewsets.ModelViewSet):
 # RoomKeyForUser viewset
 # ---------------------------
 class RoomKeyForUserViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    ?room_id=1 / ?room_ids=1,2,3   restrict to those rooms
+    ?version=N                     one key version
+    ?latest=true                   only the newest key per room
+    ?limit=&offset=                optional pagination
+
+    List responses carry an ETag derived from the rooms' key_version, so
+    clients re-polling after room_key_rotated get a 304 when nothing changed.
+    """
     serializer_class = RoomKeyForUserSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = RoomKeyPagination
 
     def get_queryset(self):
-        profile = UserProfile.objects.get(user=self.request.user)
-        qs = RoomKeyForUser.objects.filter(user=profile)
+        self.profile = UserProfile.objects.get(user=self.request.user)
+        qs = RoomKeyForUser.objects.filter(user=self.profile)
 
-        room_id = self.request.query_params.get("room_id")
+        room_ids = self.get_room_ids()
         version = self.request.query_params.get("version")
+        latest = self.request.query_params.get("latest", "").lower() in ("1", "true")
 
-        if room_id:
-            qs = qs.filter(room_id=room_id)
+        if room_ids is not None:
+            qs = qs.filter(room_id__in=room_ids)
         if version:
             try:
                 qs = qs.filter(version=int(version))
             except ValueError:
                 pass
+        if latest:
+            newest = (
+                RoomKeyForUser.objects
+                .filter(user=self.profile, room=models.OuterRef("room"))
+                .order_by("-version")
+                .values("version")[:1]
+            )
+            qs = qs.filter(version=models.Subquery(newest))
 
         return qs.order_by("-version", "-created_at")
+
+    def get_room_ids(self):
+        params = self.request.query_params
+        raw = params.get("room_ids") or params.get("room_id")
+        if not raw:
+            return None
+
+        room_ids = []
+        for value in raw.split(","):
+            try:
+                room_ids.append(int(value))
+            except ValueError:
+                continue
+        return room_ids
+
+    def get_etag(self, queryset):
+        """
+        Keys are only ever written by set_room_keys, which always bumps
+        Room.key_version, so (room, key_version) pairs identify the state.
+        """
+        rooms = (
+            Room.objects
+            .filter(id__in=queryset.values("room_id"))
+            .order_by("id")
+            .values_list("id", "key_version")
+        )
+        return make_etag(
+            self.profile.id,
+            sorted(self.request.query_params.lists()),
+            list(rooms),
+        )
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+
+        etag = self.get_etag(queryset)
+        response = not_modified(request, etag)
+        if response is not None:
+            return response
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            response = self.get_paginated_response(serializer.data)
+        else:
+            serializer = self.get_serializer(queryset, many=True)
+            response = Response(serializer.data)
+
+        return set_validators(response, etag)
@@ -0,0 +1,122 @@
+# writer.py
+import asyncio
+import collections
+import logging
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .activity import record_last_messages
+from .db import db_async
+from .models import Message
+
+logger = logging.getLogger(__name__)
+
+
+class MessageWriter:
+    """
+    Write-behind pipeline for WebSocket messages (group commit).
+
+    ``write`` queues an unsaved Message and waits until it has been
+    inserted. Queued rows are flushed with one bulk_create as soon as
+    ``max_batch`` rows are waiting or ``max_delay`` seconds have passed
+    since the first one arrived. The caller gets the instance back with
+    its id and timestamp set, so fan-out can follow exactly as before.
+    """
+
+    def __init__(self, max_batch=100, max_delay=0.005):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.pending = collections.deque()
+        self.full = asyncio.Event()
+        self.task = None
+
+    async def write(self, message):
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((message, future))
+
+        if len(self.pending) >= self.max_batch:
+            self.full.set()
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.flush_loop())
+
+        return await future
+
+    async def flush_loop(self):
+        while self.pending:
+            if len(self.pending) < self.max_batch:
+                try:
+                    await asyncio.wait_for(self.full.wait(), self.max_delay)
+                except asyncio.TimeoutError:
+                    pass
+            self.full.clear()
+
+            batch = [
+                self.pending.popleft()
+                for _ in range(min(self.max_batch, len(self.pending)))
+            ]
+            results = await self.insert([message for message, _ in batch])
+
+            for (message, future), error in zip(batch, results):
+                if future.done():
+                    continue
+                if error is None:
+                    future.set_result(message)
+                else:
+                    future.set_exception(error)
+
+    @db_async
+    def insert(self, messages):
+        """
+        Insert ``messages`` and return one error (or None) per message.
+        """
+        if connection.features.can_return_rows_from_bulk_insert:
+            try:
+                with transaction.atomic():
+                    Message.objects.bulk_create(messages)
+                    record_last_messages(messages)
+                return [None] * len(messages)
+            except Exception:
+                logger.exception(
+                    "Batched insert of %s messages failed, retrying one by one",
+                    len(messages),
+                )
+                for message in messages:
+                    message.pk = None
+
+        # Without RETURNING support (or after a failed batch) fall back
+        # to one INSERT per row so a single bad row only fails itself.
+        errors = []
+        for message in messages:
+            try:
+                with transaction.atomic():
+                    message.save(force_insert=True)
+                    record_last_messages([message])
+                errors.append(None)
+            except Exception as exc:
+                errors.append(exc)
+        return errors
+
+
+_writers = {}
+
+
+def batching_enabled():
+    return getattr(settings, "CHAT_MESSAGE_WRITE_BATCHING", False)
+
+
+def get_message_writer():
+    """
+    Return the MessageWriter bound to the running event loop (one per
+    worker process under Daphne/uvicorn).
+    """
+    loop = asyncio.get_running_loop()
+    writer = _writers.get(loop)
+    if writer is None:
+        for stale in [l for l in _writers if l.is_closed()]:
+            del _writers[stale]
+        writer = _writers[loop] = MessageWriter(
+            max_batch=getattr(settings, "CHAT_MESSAGE_BATCH_SIZE", 100),
+            max_delay=getattr(settings, "CHAT_MESSAGE_BATCH_DELAY_MS", 5) / 1000,
+        )
+    return writer